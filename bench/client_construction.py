@@ -0,0 +1,88 @@
+"""
+Measures how long a locust takes to create a client, and a mobile client to
+identify, without the stream: the update processor is a stub that is ready
+at once, and events are off. What is left is building the config and the
+client, which the init/disconnect loop and re-identify tasks do constantly.
+Usage:
+
+    python bench/client_construction.py [--clients 2000] [--users 100]
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'locust'))
+
+from ldclient.interfaces import UpdateProcessor
+
+from launchdarkly_locust import LaunchDarklyLocust, LaunchDarklyMobileLocust
+from latency import clock
+
+
+class ReadyUpdateProcessor(UpdateProcessor):
+    def __init__(self, config, *args):
+        self._ready = args[-1]
+
+    def start(self):
+        self._ready.set()
+
+    def stop(self):
+        pass
+
+    def initialized(self):
+        return True
+
+
+class BenchServer(LaunchDarklyLocust):
+    host = 'http://localhost'
+    sdk_key = 'sdk-bench'
+    update_processor_class = ReadyUpdateProcessor
+    send_events = False
+
+
+class BenchMobile(LaunchDarklyMobileLocust):
+    host = 'http://localhost'
+    sdk_key = 'mob-bench'
+    update_processor_class = ReadyUpdateProcessor
+    send_events = False
+
+
+def users(count):
+    return [{'key': 'user-%d' % i, 'email': 'user-%d@example.com' % i, 'country': 'us',
+             'custom': {'groups': ['beta', 'group-%d' % (i % 10)], 'plan': 'plan-%d' % (i % 4)}}
+            for i in range(count)]
+
+
+def per_call_us(fn, calls):
+    start = clock()
+    for i in range(calls):
+        fn(i)
+    return (clock() - start) * 1000000 / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=2000, help='clients created per run')
+    parser.add_argument('--users', type=int, default=100, help='distinct users the clients cycle through')
+    args = parser.parse_args()
+    population = users(args.users)
+
+    server = BenchServer()
+    mobile = BenchMobile()
+    client = mobile.make_client(population[0])
+
+    results = [
+        ('server make_client', per_call_us(lambda i: server.make_client().close(), args.clients)),
+        ('mobile make_client', per_call_us(lambda i: mobile.make_client(population[i % len(population)]).close(),
+                                           args.clients)),
+        ('mobile identify', per_call_us(lambda i: client.identify(population[i % len(population)]), args.clients)),
+    ]
+    client.close()
+
+    print('%-20s %12s' % ('operation', 'us per call'))
+    for name, us in results:
+        print('%-20s %12.1f' % (name, us))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Reports the memory each virtual user's feature store costs, with the default
+InMemoryFeatureStore and with SharedFeatureStore.
+
+Every simulated client decodes its own copy of the payload, like the stream
+processors do, and initializes its store the way the client wrapper does.
+Usage:
+
+    python bench/flag_store_memory.py [--flags 1000] [--users 500] [--variants 4]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'locust'))
+
+from ldclient.feature_store import InMemoryFeatureStore, _FeatureStoreDataSetSorter
+from ldclient.versioned_data_kind import FEATURES, SEGMENTS
+
+from shared_feature_store import SharedFeatureStore, INTERN_BY_VERSION, INTERN_BY_CONTENT
+
+
+def server_payload(num_flags):
+    flags = {}
+    for i in range(num_flags):
+        key = 'flag-%d' % i
+        flags[key] = {'key': key, 'version': 1, 'on': True, 'variations': [True, False], 'salt': 'salt-%d' % i,
+                      'fallthrough': {'variation': 0}, 'offVariation': 1, 'targets': [], 'prerequisites': [],
+                      'rules': [{'clauses': [{'attribute': 'email', 'op': 'endsWith', 'values': ['@example.com'],
+                                              'negate': False}], 'variation': 1, 'id': 'rule-%d' % i}]}
+    return json.dumps({'flags': flags, 'segments': {}})
+
+
+def mobile_payload(num_flags, variant):
+    flags = {}
+    for i in range(num_flags):
+        v = (i + variant) % 2
+        flags['flag-%d' % i] = {'value': bool(v), 'variation': v, 'version': 1, 'trackEvents': False}
+    return json.dumps(flags)
+
+
+def measure(make_store, payloads, num_users):
+    gc.collect()
+    tracemalloc.start()
+    stores = []
+    for n in range(num_users):
+        store = make_store()
+        data = json.loads(payloads[n % len(payloads)])
+        if 'flags' in data:
+            all_data = {FEATURES: data['flags'], SEGMENTS: data['segments']}
+        else:
+            for key, flag in data.items():
+                flag['key'] = key
+            all_data = {FEATURES: data}
+        store.init(_FeatureStoreDataSetSorter.sort_all_collections(all_data))
+        stores.append(store)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used / float(num_users)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--flags', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--variants', type=int, default=4,
+                        help='number of distinct mobile payloads across users')
+    args = parser.parse_args()
+
+    server = [server_payload(args.flags)]
+    mobile = [mobile_payload(args.flags, random.randint(0, 1 << 16)) for _ in range(args.variants)]
+    print('%d flags, %d users' % (args.flags, args.users))
+    print('%-8s %-22s %16s' % ('client', 'store', 'bytes per user'))
+    for label, payloads, intern_by in (('server', server, INTERN_BY_VERSION), ('mobile', mobile, INTERN_BY_CONTENT)):
+        before = measure(InMemoryFeatureStore, payloads, args.users)
+        after = measure(lambda: SharedFeatureStore(intern_by=intern_by), payloads, args.users)
+        print('%-8s %-22s %16.0f' % (label, 'InMemoryFeatureStore', before))
+        print('%-8s %-22s %16.0f' % (label, 'SharedFeatureStore', after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Measures how long decoding a large put payload blocks the gevent hub, with
+the payload decoded inline and offloaded to the thread pool.
+
+A probe greenlet like the one in hub_monitor.py wakes up every millisecond
+while a put is decoded, and the longest delay it saw is how long every other
+virtual user would have been held up. Usage:
+
+    python bench/hub_blocking.py [--flags 20000] [--rounds 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'locust'))
+
+import gevent
+
+from payload_cache import PayloadCache
+
+
+def put_payload(num_flags):
+    flags = {}
+    for i in range(num_flags):
+        key = 'flag-%d' % i
+        flags[key] = {'key': key, 'version': 1, 'on': True, 'variations': [True, False], 'salt': 'salt-%d' % i,
+                      'fallthrough': {'variation': 0}, 'offVariation': 1, 'targets': [], 'prerequisites': [],
+                      'rules': [{'clauses': [{'attribute': 'email', 'op': 'endsWith', 'values': ['@example.com'],
+                                              'negate': False}], 'variation': 1, 'id': 'rule-%d' % i}]}
+    return json.dumps({'path': '/', 'data': {'flags': flags, 'segments': {}}}).encode('utf-8')
+
+
+def max_hub_delay(fn, interval=0.001):
+    delays = []
+
+    def probe():
+        while True:
+            start = time.time()
+            gevent.sleep(interval)
+            delays.append(time.time() - start - interval)
+
+    prober = gevent.spawn(probe)
+    gevent.sleep(interval * 5)
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    prober.kill()
+    return max(delays), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--flags', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    payload = put_payload(args.flags)
+    print('put payload: %d flags, %.1f MB' % (args.flags, len(payload) / 1e6))
+    print('%-10s %18s %12s' % ('decode', 'max hub block ms', 'wall ms'))
+    for label, offload_bytes in (('inline', 0), ('offload', 1)):
+        blocked = wall = 0
+        for _ in range(args.rounds):
+            # a fresh cache every round so every decode is a miss
+            cache = PayloadCache(offload_bytes=offload_bytes)
+            b, w = max_hub_delay(lambda: cache.decode('put', payload))
+            blocked = max(blocked, b)
+            wall += w
+        print('%-10s %18.1f %12.1f' % (label, blocked * 1000, wall * 1000 / args.rounds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Measures the per-call cost of variation() and all_flags_state() on a mobile
+client, with evaluation results precomputed when the flags arrive and with
+the previous evaluate(), which stringified the user and built a new
+EvaluationDetail on every call.
+
+The client's store is filled directly by a stub update processor, so no
+relay is needed. Usage:
+
+    python bench/mobile_evaluation.py [--flags 100 1000 10000] [--calls 20000]
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'locust'))
+
+from ldclient.flag import __USER_ATTRS_TO_STRINGIFY_FOR_EVALUATION__, EvalResult, EvaluationDetail
+from ldclient.interfaces import UpdateProcessor
+from ldclient.util import stringify_attrs
+from ldclient.versioned_data_kind import FEATURES
+
+import ldclient_mobile
+from client_evaluate import evaluate, precompute_all
+from config_mobile import MobileConfig
+from ldclient_mobile import MobileLDClient
+from latency import clock
+
+
+def legacy_evaluate(flag, user, store, event_factory):
+    sanitized_user = stringify_attrs(user, __USER_ATTRS_TO_STRINGIFY_FOR_EVALUATION__)
+    detail = EvaluationDetail(flag.get('value'), flag.get('variation'), flag.get('reason'))
+    return EvalResult(detail=detail, events=None)
+
+
+def mobile_flags(num_flags):
+    flags = {}
+    for i in range(num_flags):
+        key = 'flag-%d' % i
+        flags[key] = {'key': key, 'value': i % 2 == 0, 'variation': i % 2, 'version': 1, 'flagVersion': 1,
+                      'trackEvents': False, 'reason': {'kind': 'FALLTHROUGH'}}
+    return flags
+
+
+def preloaded(flags):
+    class PreloadedUpdateProcessor(UpdateProcessor):
+        def __init__(self, config, store, ready):
+            self._store = store
+            self._ready = ready
+
+        def start(self):
+            self._store.init({FEATURES: flags})
+            self._ready.set()
+
+        def stop(self):
+            pass
+
+        def initialized(self):
+            return self._ready.is_set()
+
+    return PreloadedUpdateProcessor
+
+
+def per_call_us(fn, calls):
+    start = clock()
+    for _ in range(calls):
+        fn()
+    return (clock() - start) * 1000000 / calls
+
+
+def run(num_flags, calls, evaluate_fn, precomputed):
+    flags = mobile_flags(num_flags)
+    if precomputed:
+        precompute_all(flags)
+    ldclient_mobile.evaluate = evaluate_fn
+    config = MobileConfig(sdk_key='bench', update_processor_class=preloaded(flags), send_events=False)
+    client = MobileLDClient({'key': 'bench-user', 'custom': {'groups': ['a', 'b']}}, config=config)
+    try:
+        key = 'flag-%d' % (num_flags // 2)
+        variation = per_call_us(lambda: client.variation(key, False), calls)
+        state = per_call_us(client.all_flags_state, max(calls * 10 // num_flags, 10))
+        return variation, state
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--flags', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--calls', type=int, default=20000, help='variation() calls per run')
+    args = parser.parse_args()
+
+    print('%-8s %-12s %16s %20s' % ('flags', 'evaluate', 'variation (us)', 'all_flags_state (us)'))
+    for num_flags in args.flags:
+        for label, evaluate_fn, precomputed in (('legacy', legacy_evaluate, False), ('precomputed', evaluate, True)):
+            variation, state = run(num_flags, args.calls, evaluate_fn, precomputed)
+            print('%-8d %-12s %16.2f %20.1f' % (num_flags, label, variation, state))
+
+
+if __name__ == '__main__':
+    main()
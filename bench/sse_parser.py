@@ -0,0 +1,128 @@
+"""
+Compares the byte-level SSE parser in sse_client.py against the previous
+implementation, which appended every chunk to a str buffer and re-split it.
+
+Runs entirely in memory: the response stream is replaced by pre-built chunks,
+so no relay is needed. Usage:
+
+    python bench/sse_parser.py [--put-mb 4] [--patches 20000] [--chunk-size 10000]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'locust'))
+
+from sse_client import SSEClient, Event
+from latency import clock
+
+
+legacy_end_of_field = re.compile(r'\r\n\r\n|\r\r|\n\n')
+
+
+class StreamEnd(Exception):
+    pass
+
+
+class ReplayClient(SSEClient):
+    """Reads from an in-memory list of chunks instead of the network."""
+
+    def __init__(self, chunks, chunk_size):
+        self._chunks = chunks
+        super(ReplayClient, self).__init__('http://localhost/all', retry=0, chunk_size=chunk_size)
+
+    def _connect(self):
+        if hasattr(self, 'resp_file'):
+            raise StreamEnd()
+        self._last_heartbeat = None
+        self._connect_start = clock()
+        self.resp_file = iter(self._chunks)
+
+
+class LegacyReplayClient(ReplayClient):
+    """The parsing loop as it was before the byte-level parser."""
+
+    def __init__(self, chunks, chunk_size):
+        super(LegacyReplayClient, self).__init__(chunks, chunk_size)
+        self.buf = u''
+
+    def _event_complete(self):
+        return re.search(legacy_end_of_field, self.buf[len(self.buf)-self._chunk_size-10:]) is not None
+
+    def __next__(self):
+        while not self._event_complete():
+            try:
+                self.buf += next(self.resp_file).decode("utf-8")
+            except StopIteration:
+                raise StreamEnd()
+
+        split = re.split(legacy_end_of_field, self.buf)
+        head = split[0]
+        tail = "".join(split[1:])
+
+        self.buf = tail
+        return Event.parse(head, instance=self)
+
+
+def make_stream(put_mb, patches):
+    flags = {}
+    i = 0
+    size = 0
+    while size < put_mb * 1024 * 1024:
+        flag = {'key': 'flag-%d' % i, 'version': 1, 'on': True, 'variations': [True, False],
+                'fallthrough': {'variation': 0}, 'offVariation': 1, 'rules': [], 'salt': 'x' * 32}
+        flags[flag['key']] = flag
+        size += len(json.dumps(flag))
+        i += 1
+    put = {'path': '/', 'data': {'flags': flags, 'segments': {}}}
+    parts = [b'event: put\ndata: ' + json.dumps(put).encode('utf-8') + b'\n\n']
+    for n in range(patches):
+        patch = {'path': '/flags/flag-%d' % (n % i), 'data': {'key': 'flag-%d' % (n % i), 'version': n + 2}}
+        parts.append(b'event: patch\ndata: ' + json.dumps(patch).encode('utf-8') + b'\n\n')
+        if n % 10 == 0:
+            parts.append(b':\n\n')
+    return b''.join(parts), 1 + patches + (patches + 9) // 10
+
+
+def split_chunks(stream, chunk_size):
+    return [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+
+def run(client_class, chunks, chunk_size):
+    client = client_class(chunks, chunk_size)
+    parsed = 0
+    wall_start = time.time()
+    cpu_start = time.process_time()
+    try:
+        while True:
+            next(client)
+            parsed += 1
+    except StreamEnd:
+        pass
+    return parsed, time.time() - wall_start, time.process_time() - cpu_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--put-mb', type=float, default=4)
+    parser.add_argument('--patches', type=int, default=20000)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    stream, num_events = make_stream(args.put_mb, args.patches)
+    chunks = split_chunks(stream, args.chunk_size)
+    mb = len(stream) / (1024.0 * 1024.0)
+    print('stream: %.2f MB, %d events, %d chunks of %d bytes' % (mb, num_events, len(chunks), args.chunk_size))
+    # the legacy parser merges events that arrive in the same buffer, so it
+    # may report fewer events than were sent
+    print('%-8s %10s %12s %12s %14s' % ('parser', 'events', 'wall (s)', 'events/sec', 'cpu ms per MB'))
+    for label, client_class in (('legacy', LegacyReplayClient), ('bytes', ReplayClient)):
+        parsed, wall, cpu = run(client_class, chunks, args.chunk_size)
+        print('%-8s %10d %12.3f %12.0f %14.2f' % (label, parsed, wall, parsed / wall, cpu * 1000 / mb))
+
+
+if __name__ == '__main__':
+    main()
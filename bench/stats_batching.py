@@ -0,0 +1,71 @@
+"""
+Measures what report_success costs per successful request with locust's
+request_success event and with LOCUST_BATCH_STATS batching, flushes
+included, and checks that both end up with the same stats. Usage:
+
+    python bench/stats_batching.py [--events 200000] [--names 20]
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'locust'))
+
+from locust.stats import global_stats
+
+import stats_aggregator
+from latency import clock
+
+
+def sample_time(rng):
+    # mostly fast responses with a long tail, like heartbeats and flag
+    # requests, and a few negative ones, like propagation under clock skew
+    roll = rng.random()
+    if roll < 0.01:
+        return -rng.randrange(1, 50)
+    if roll < 0.95:
+        return int(rng.expovariate(1 / 20.0))
+    return rng.randrange(100, 20000)
+
+
+def samples(count, names, seed=0):
+    rng = random.Random(seed)
+    return [('GET', 'name-%d' % rng.randrange(names), sample_time(rng), rng.randrange(2000)) for _ in range(count)]
+
+
+def run(events, batched, flush_every):
+    stats_aggregator.enabled = batched
+    global_stats.reset_all()
+    start = clock()
+    for i, (request_type, name, response_time, response_length) in enumerate(events):
+        stats_aggregator.report_success(request_type, name, response_time, response_length)
+        if batched and i % flush_every == 0:
+            stats_aggregator.flush()
+    stats_aggregator.flush()
+    elapsed = clock() - start
+    summary = sorted((key, entry.num_requests, entry.total_response_time, entry.response_times)
+                     for key, entry in global_stats.entries.items())
+    return elapsed * 1000000000 / len(events), summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--events', type=int, default=200000, help='successful requests reported per run')
+    parser.add_argument('--names', type=int, default=20, help='distinct request names')
+    parser.add_argument('--flush-every', type=int, default=10000,
+                        help='requests between flushes, about a second of a busy worker')
+    args = parser.parse_args()
+    events = samples(args.events, args.names)
+
+    direct_ns, direct = run(events, False, args.flush_every)
+    batched_ns, batched = run(events, True, args.flush_every)
+
+    print('%-12s %12s' % ('stats', 'ns per call'))
+    print('%-12s %12.0f' % ('event', direct_ns))
+    print('%-12s %12.0f' % ('batched', batched_ns))
+    print('same stats: %s' % (direct == batched))
+
+
+if __name__ == '__main__':
+    main()
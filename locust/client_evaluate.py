@@ -1,19 +1,25 @@
-import six
-import sys
+from ldclient.flag import EvalResult, EvaluationDetail
 
-from ldclient.util import stringify_attrs, log
-from ldclient.versioned_data_kind import FEATURES, SEGMENTS
+# mobile flags are already evaluated by the relay, so the result of each one
+# is built once when it arrives and stored on the flag under this key
+RESULT_KEY = '_result'
 
-from ldclient.flag import __USER_ATTRS_TO_STRINGIFY_FOR_EVALUATION__, EvalResult, EvaluationDetail
 
+def precompute(flag):
+    """Stores the flag's evaluation result on it, and returns the flag."""
+    detail = EvaluationDetail(flag.get('value'), flag.get('variation'), flag.get('reason'))
+    flag[RESULT_KEY] = EvalResult(detail=detail, events=None)
+    return flag
 
 
-def evaluate(flag, user, store, event_factory):
-    sanitized_user = stringify_attrs(user, __USER_ATTRS_TO_STRINGIFY_FOR_EVALUATION__)
-    value = flag.get('value')
-    version = flag.get('version')
-    variation_index = flag.get('variation')
-    reason = flag.get('reason')
-    detail = EvaluationDetail(value, variation_index, reason)
+def precompute_all(flags):
+    for flag in flags.values():
+        precompute(flag)
+    return flags
+
 
-    return EvalResult(detail = detail, events = None)
+def evaluate(flag, user, store, event_factory):
+    result = flag.get(RESULT_KEY)
+    if result is None:
+        result = precompute(dict(flag))[RESULT_KEY]
+    return result
@@ -1,3 +1,7 @@
+import copy
+import os
+from collections import OrderedDict
+
 from ldclient.config import Config
 from ldclient.user_filter import UserFilter
 import json
@@ -5,6 +9,45 @@ from base64 import urlsafe_b64encode
 from ldclient.event_processor import DefaultEventProcessor
 from ldclient.feature_store import InMemoryFeatureStore
 
+class UserEncodingCache(object):
+  """
+  Process-wide, size-bounded cache of users' filtered JSON and base64 form.
+  Locusts hand the same user object to every client they create, so entries
+  are keyed by user identity, and only used while the user still equals the
+  copy taken when it was encoded. LOCUST_USER_CACHE_SIZE sets how many users
+  are kept (default 10000, 0 disables the cache).
+  """
+  def __init__(self, max_entries=10000):
+    self.max_entries = max_entries
+    self._entries = OrderedDict()
+
+  @classmethod
+  def from_env(cls):
+    return cls(max_entries=int(os.environ.get('LOCUST_USER_CACHE_SIZE', 10000)))
+
+  def encode(self, user, user_filter, filter_key):
+    key = (id(user), filter_key)
+    entry = self._entries.get(key)
+    # the entry holds on to the user, so its id can't be reused while it is cached
+    if entry is not None and entry[0] is user and entry[1] == user:
+      self._entries.move_to_end(key)
+      return entry[2], entry[3]
+    user_json = json.dumps(user_filter.filter_user_props(user)).encode('utf-8')
+    user_b64 = urlsafe_b64encode(user_json).decode('utf-8')
+    if self.max_entries > 0:
+      self._entries[key] = (user, copy.deepcopy(user), user_json, user_b64)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+    return user_json, user_b64
+
+  def __len__(self):
+    return len(self._entries)
+
+
+user_encodings = UserEncodingCache.from_env()
+
+
 class MobileConfig(Config):
   def __init__(self,sdk_key=None, user=None, use_report=False, evaluation_reasons=False,
                  base_uri='https://app.launchdarkly.com',
@@ -70,9 +113,15 @@ class MobileConfig(Config):
     self.__user = user
     self.__user_filter = UserFilter(self)
     if user is not None:
-      self.__user_filtered = self.__user_filter.filter_user_props(user)
-      self.__user_json = json.dumps(self.__user_filtered).encode('utf-8')
-      self.__user_b64 = urlsafe_b64encode(self.__user_json).decode('utf-8')
+      self.__user_json, self.__user_b64 = self.__encode_user(user)
+
+  def __encode_user(self, user):
+    # population users come with their filtered JSON and base64 already built
+    encoded = user.encoded_for(self.__private_attribute_names, self.__all_attributes_private) if hasattr(user, 'encoded_for') else None
+    if encoded is not None:
+      return encoded
+    return user_encodings.encode(user, self.__user_filter,
+                                 (tuple(self.__private_attribute_names), self.__all_attributes_private))
 
 
   def copy_with_new_sdk_key(self, new_sdk_key):
@@ -108,39 +157,19 @@ class MobileConfig(Config):
                   evaluation_reasons=self.__evaluation_reasons,
                   user=self.__user)
   def copy_with_new_user(self, new_user, new_sdk_key=None):
-    """Returns a new ``Config`` instance that is the same as this one, except for having a different SDK key.
+    """Returns a new ``Config`` instance that is the same as this one, except for having a different user,
+    and optionally a different SDK key. The feature store is shared with this config.
+    :param dict new_user: the new user
     :param string new_sdk_key: the new SDK key
-    :rtype: ldclient.config.Config
+    :rtype: MobileConfig
     """
-    key = new_sdk_key or self.sdk_key
-    
-    return MobileConfig(sdk_key=key,
-                  base_uri=self.__base_uri,
-                  events_uri=self.__events_uri,
-                  connect_timeout=self.__connect_timeout,
-                  read_timeout=self.__read_timeout,
-                  events_max_pending=self.__events_max_pending,
-                  flush_interval=self.__flush_interval,
-                  stream_uri=self.__stream_uri,
-                  stream=self.__stream,
-                  verify_ssl=self.__verify_ssl,
-                  defaults=self.__defaults,
-                  send_events=self.__send_events,
-                  update_processor_class=self.__update_processor_class,
-                  poll_interval=self.__poll_interval,
-                  use_ldd=self.__use_ldd,
-                  feature_store=self.__feature_store,
-                  feature_requester_class=self.__feature_requester_class,
-                  event_processor_class=self.__event_processor_class,
-                  private_attribute_names=self.__private_attribute_names,
-                  all_attributes_private=self.__all_attributes_private,
-                  offline=self.__offline,
-                  user_keys_capacity=self.__user_keys_capacity,
-                  user_keys_flush_interval=self.__user_keys_flush_interval,
-                  inline_users_in_events=self.__inline_users_in_events,
-                  use_report=self.__use_report,
-                  evaluation_reasons=self.__evaluation_reasons,
-                  user=new_user)
+    config = copy.copy(self)
+    if new_sdk_key:
+      config.__sdk_key = new_sdk_key
+    config.__user = new_user
+    if new_user is not None:
+      config.__user_json, config.__user_b64 = self.__encode_user(new_user)
+    return config
 
 
   @property
@@ -0,0 +1,158 @@
+"""
+Locusts that post analytics events straight to the relay's event endpoints.
+
+Events sent by the SDK locusts go through DefaultEventProcessor, which
+summarizes them, dedups users and only flushes every flush_interval, so they
+can't push the event endpoints to their limit. EventFirehoseLocust and
+MobileEventFirehoseLocust instead post batches from a corpus that is built
+and serialized once per process, using example-event.json as the template
+for users and summaries. Each locust posts batches_per_second batches of
+batch_size events, so the total rate is that times the number of locusts.
+
+Posts are reported as events:post, named after the endpoint, with the size of
+the posted body as the response length. Settings:
+
+- LOCUST_EVENT_BATCH_SIZE: events per batch (default 50)
+- LOCUST_EVENT_RATE: batches per second per locust (default 1)
+- LOCUST_EVENT_CORPUS: distinct batches to cycle through (default 100)
+- LOCUST_EVENT_GZIP: set to 1 to gzip the batches
+"""
+import copy
+import gzip
+import json
+import os
+import random
+import time
+
+from locust import TaskSet, task, constant_pacing
+
+from util import _headers
+from pool_registry import get_pool_manager
+from saturation import MonitoredLocust
+
+EVENT_SCHEMA = '3'
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'example-event.json')
+
+# corpora are shared by every locust with the same settings
+_corpora = {}
+
+
+def _load_template(path):
+    with open(path) as template_file:
+        events = json.load(template_file)
+    user = next(e['user'] for e in events if e.get('kind') == 'identify')
+    summary = next(e for e in events if e.get('kind') == 'summary')
+    return user, summary
+
+
+def build_batch(rng, user_template, summary_template, batch_size, num_users, num_flags, mobile):
+    """
+    Builds one batch the way an SDK would flush it: an identify (mobile) or
+    index (server) event for each user seen, feature and custom events, and
+    a summary of every evaluation in the batch.
+    """
+    now = int(time.time() * 1000)
+    events = []
+    counters = {}
+    # a batch covers a few users with several evaluations each
+    batch_users = ['user-%d' % rng.randrange(num_users) for _ in range(max(batch_size // 10, 1))]
+    users_seen = set()
+    while len(events) < batch_size - 1:
+        user = copy.deepcopy(user_template)
+        user['key'] = rng.choice(batch_users)
+        user['anonymous'] = False
+        if user['key'] not in users_seen:
+            users_seen.add(user['key'])
+            events.append({'kind': 'identify' if mobile else 'index', 'creationDate': now,
+                           'key': user['key'], 'user': user})
+            continue
+        if rng.random() < 0.2:
+            events.append({'kind': 'custom', 'creationDate': now, 'key': 'test_event',
+                           'userKey': user['key'], 'metricValue': 1})
+            continue
+        flag_key = 'flag-%d' % rng.randrange(num_flags)
+        variation = rng.randrange(2)
+        counter = (flag_key, variation)
+        counters[counter] = counters.get(counter, 0) + 1
+        events.append({'kind': 'feature', 'creationDate': now, 'key': flag_key, 'userKey': user['key'],
+                       'version': 2, 'variation': variation, 'value': variation == 0, 'default': None})
+
+    summary = copy.deepcopy(summary_template)
+    summary['startDate'] = summary['endDate'] = now
+    summary['features'] = {}
+    for (flag_key, variation), count in sorted(counters.items()):
+        feature = summary['features'].setdefault(flag_key, {'default': None, 'counters': []})
+        feature['counters'].append({'count': count, 'value': variation == 0, 'variation': variation, 'version': 2})
+    events.append(summary)
+    return events
+
+
+def get_corpus(mobile, batch_size, corpus_size, num_users, num_flags, use_gzip, template_path=TEMPLATE_PATH):
+    """
+    Returns a list of serialized (and optionally gzipped) batches, built
+    once per process for each combination of settings.
+    """
+    key = (mobile, batch_size, corpus_size, num_users, num_flags, use_gzip, template_path)
+    corpus = _corpora.get(key)
+    if corpus is None:
+        rng = random.Random(0)
+        user_template, summary_template = _load_template(template_path)
+        corpus = []
+        for _ in range(corpus_size):
+            batch = build_batch(rng, user_template, summary_template, batch_size, num_users, num_flags, mobile)
+            body = json.dumps(batch, separators=(',', ':')).encode('utf-8')
+            corpus.append(gzip.compress(body) if use_gzip else body)
+        _corpora[key] = corpus
+    return corpus
+
+
+class EventFirehoseTaskSet(TaskSet):
+    @task
+    def post_batch(self):
+        self.locust.post_batch()
+
+
+class EventFirehoseLocust(MonitoredLocust):
+    sdk_key = os.environ.get('LAUNCHDARKLY_SDK_KEY')
+    events_uri = os.environ.get('LAUNCHDARKLY_EVENTS_URI')
+    events_path = '/bulk'
+    mobile = False
+    batch_size = int(os.environ.get('LOCUST_EVENT_BATCH_SIZE', 50))
+    batches_per_second = float(os.environ.get('LOCUST_EVENT_RATE', 1))
+    corpus_size = int(os.environ.get('LOCUST_EVENT_CORPUS', 100))
+    use_gzip = os.environ.get('LOCUST_EVENT_GZIP') == '1'
+    num_users = 1000
+    num_flags = 100
+    task_set = EventFirehoseTaskSet
+
+    def __init__(self, *args, **kwargs):
+        super(EventFirehoseLocust, self).__init__(*args, **kwargs)
+        if self.events_uri is None:
+            self.events_uri = self.host
+        self._pacing = constant_pacing(1.0 / self.batches_per_second)
+        self.corpus = get_corpus(self.mobile, self.batch_size, self.corpus_size, self.num_users, self.num_flags,
+                                 self.use_gzip)
+        # start every locust at a different batch so they don't post in lockstep
+        self._next_batch = random.randrange(len(self.corpus))
+        self._url = self.events_uri.rstrip('/') + self.events_path
+        self._http = get_pool_manager(self.events_uri)
+        self._headers = _headers(self.sdk_key)
+        self._headers['X-LaunchDarkly-Event-Schema'] = EVENT_SCHEMA
+        if self.use_gzip:
+            self._headers['Content-Encoding'] = 'gzip'
+
+    # posts batches_per_second batches however long each post takes
+    def wait_time(self):
+        return self._pacing(self)
+
+    def post_batch(self):
+        body = self.corpus[self._next_batch]
+        self._next_batch = (self._next_batch + 1) % len(self.corpus)
+        self._http.request('POST', self._url, body=body, headers=self._headers,
+                           request_type='events:post', report_body_size=True)
+
+
+class MobileEventFirehoseLocust(EventFirehoseLocust):
+    sdk_key = os.environ.get('LAUNCHDARKLY_MOBILE_KEY')
+    events_path = '/mobile/events/bulk'
+    mobile = True
@@ -3,13 +3,19 @@ Default implementation of feature flag polling requests.
 """
 # currently excluded from documentation - see docs/README.md
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import hashlib
 import json
+import os
 import urllib3
 
 from ldclient.interfaces import FeatureRequester
 from ldclient.util import UnsuccessfulResponseException
-from util import _headers, create_http_pool_manager
+from util import _headers, clean_name
+from pool_registry import get_pool_manager
+from stats_aggregator import report_success
+from client_evaluate import precompute
+from latency import clock
 #from ldclient.util import create_http_pool_manager
 from ldclient.util import log
 from ldclient.util import throw_if_unsuccessful_response
@@ -20,22 +26,73 @@ from base64 import urlsafe_b64encode
 EVALX_GET = '/msdk/evalx/users'
 EVALX_REPORT = '/msdk/evalx/user'
 
-CacheEntry = namedtuple('CacheEntry', ['data', 'etag'])
+CacheEntry = namedtuple('CacheEntry', ['data', 'etag', 'size'])
+
+
+class EtagCache(object):
+    """
+    Process-wide, size-bounded cache of the last evalx response for each
+    (sdk key, user, reasons) so that polls and ping-triggered fetches can be
+    conditional, whichever client makes them. Entries are shared between
+    clients and must not be changed. LOCUST_ETAG_CACHE_SIZE sets how many
+    users are kept (default 10000, 0 disables the cache).
+
+    Every fetch is reported as one of etag:304 (the cached copy was still
+    current, with the bytes saved), etag:changed (sent an ETag but got a new
+    payload) or etag:uncached (no ETag to send).
+    """
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_entries=int(os.environ.get('LOCUST_ETAG_CACHE_SIZE', 10000)))
+
+    @staticmethod
+    def make_key(config):
+        return (config.sdk_key, hashlib.sha1(config.user_json).digest(), bool(config.evaluation_reasons))
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+etag_cache = EtagCache.from_env()
 
 
 class FeatureRequesterImpl(FeatureRequester):
     def __init__(self, config):
-        self._cache = dict()
-        self._http = create_http_pool_manager(num_pools=1, verify_ssl=config.verify_ssl,
-            target_base_uri=config.base_uri, force_proxy=config.http_proxy)
+        self._cache = etag_cache
+        self._http = get_pool_manager(config.base_uri, verify_ssl=config.verify_ssl,
+            force_proxy=config.http_proxy)
         self._config = config
  
+    def use_config(self, config):
+        """
+        Switches to another user's config, keeping the connection pool and
+        the conditional request cache.
+        """
+        self._config = config
+
     def get_all_data(self):
         all_data = self._do_request(self._config.base_uri, True)
-        for k,v in all_data.items():
-          v['key'] = k
+        # the cached flags are shared, so the store gets its own dict of them
         return {
-            FEATURES: all_data
+            FEATURES: dict(all_data)
         }
 
     def get_one(self, kind, key):
@@ -46,39 +103,50 @@ class FeatureRequesterImpl(FeatureRequester):
         method = "GET"
         body = None
         uri = base_uri
-        cache_uri = uri + EVALX_GET + '/' + self._config.user_b64
         if self._config.use_report:
           method = 'REPORT'
           body = self._config.user_json
           hdrs.update({'Content-Type': 'application/json'})
           uri = uri + EVALX_REPORT
         else:
-          uri = cache_uri
+          uri = uri + EVALX_GET + '/' + self._config.user_b64
         if self._config.evaluation_reasons:
           uri += '?withReasons=true'
-          cache_uri += '?withReasons=true'
 
+        cache_entry = None
         if allow_cache:
-            cache_entry = self._cache.get(cache_uri)
+            cache_key = self._cache.make_key(self._config)
+            cache_entry = self._cache.get(cache_key)
             if cache_entry is not None:
                 hdrs['If-None-Match'] = cache_entry.etag
 
+        start_time = clock()
         r = self._http.request(method, uri,
                                headers=hdrs,
                                timeout=urllib3.Timeout(connect=self._config.connect_timeout, read=self._config.read_timeout),
                                retries=1,
                                body=body)
         throw_if_unsuccessful_response(r)
-        if r.status == 304 and allow_cache and cache_entry is not None:
+        elapsed = clock() - start_time
+        if r.status == 304 and cache_entry is not None:
             data = cache_entry.data
             etag = cache_entry.etag
             from_cache = True
+            report_success(request_type='etag:304', name=clean_name(method, uri), response_time=int(elapsed * 1000), response_length=cache_entry.size,
+                           response_time_us=elapsed * 1000000)
         else:
             data = json.loads(r.data.decode('UTF-8'))
+            for k,v in data.items():
+              v['key'] = k
+              precompute(v)
             etag = r.getheader('ETag')
             from_cache = False
-            if allow_cache and etag is not None:
-                self._cache[uri] = CacheEntry(data=data, etag=etag)
+            if allow_cache:
+                report_success(request_type='etag:changed' if cache_entry is not None else 'etag:uncached',
+                               name=clean_name(method, uri), response_time=int(elapsed * 1000), response_length=len(r.data),
+                               response_time_us=elapsed * 1000000)
+                if etag is not None:
+                    self._cache.put(cache_key, CacheEntry(data=data, etag=etag, size=len(r.data)))
         log.debug("%s response status:[%d] From cache? [%s] ETag:[%s]",
             uri, r.status, from_cache, etag)
         return data
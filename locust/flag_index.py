@@ -0,0 +1,62 @@
+"""
+Index of the flag keys a client currently knows about, kept up to date by the
+stream processors, so that task sets can pick a random flag without
+evaluating every flag first.
+"""
+import random
+
+from util import AliasTable
+
+
+class FlagKeyIndex(object):
+    def __init__(self):
+        self._keys = []
+        self._positions = {}
+        self._version = 0
+        self._alias = None
+        self._alias_for = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def reset(self, keys):
+        self._keys = list(keys)
+        self._positions = dict((key, i) for i, key in enumerate(self._keys))
+        self._version += 1
+
+    def add(self, key):
+        if key in self._positions:
+            return
+        self._positions[key] = len(self._keys)
+        self._keys.append(key)
+        self._version += 1
+
+    def remove(self, key):
+        i = self._positions.pop(key, None)
+        if i is None:
+            return
+        # move the last key into the hole so removal stays O(1)
+        last = self._keys.pop()
+        if last != key:
+            self._keys[i] = last
+            self._positions[last] = i
+        self._version += 1
+
+    def choice(self, weights=None, rng=random):
+        """
+        Returns a random key, or None if the index is empty. Keys are picked
+        uniformly unless a {key: weight} mapping is given, in which case keys
+        missing from it have a weight of 1. The weighted table is rebuilt only
+        after the keys or the mapping change.
+        """
+        if not self._keys:
+            return None
+        if not weights:
+            return self._keys[int(rng.random() * len(self._keys))]
+        if self._alias_for != (self._version, id(weights)):
+            self._alias = AliasTable([weights.get(key, 1) for key in self._keys])
+            self._alias_for = (self._version, id(weights))
+        return self._keys[self._alias.sample(rng)]
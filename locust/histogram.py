@@ -0,0 +1,100 @@
+"""
+High resolution latency histogram.
+
+Locust rounds response times to whole milliseconds and then to 10, 100 and
+1000ms steps, which hides the differences we care about in propagation
+latency. Histogram keeps values exactly up to 2**sub_bucket_bits and within
+a relative error of 2**-(sub_bucket_bits - 1) above that (under 1% with the
+default of 8 bits), in a sparse dict of bucket counts that is cheap to ship
+from slaves and to merge on the master. Values are non-negative integers in
+whatever unit the caller picks, usually microseconds.
+"""
+
+
+class Histogram(object):
+    def __init__(self, sub_bucket_bits=8):
+        self.sub_bucket_bits = sub_bucket_bits
+        self._linear = 1 << sub_bucket_bits
+        self._half = self._linear >> 1
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        if value < self._linear:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self._linear + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _value_at(self, index):
+        # the middle of the bucket, so the error is at most half a bucket
+        if index < self._linear:
+            return index
+        shift, offset = divmod(index - self._linear, self._half)
+        shift += 1
+        return ((offset + self._half) << shift) + (1 << (shift - 1))
+
+    def record(self, value, count=1):
+        value = max(int(round(value)), 0)
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError('cannot merge histograms with different precision')
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @property
+    def mean(self):
+        return self.total / float(self.count) if self.count else 0
+
+    def value_at_percentile(self, percentile):
+        """
+        Returns the value below which the given percentile (0-100) of the
+        recorded values fall, clamped to the recorded min and max.
+        """
+        if not self.count:
+            return 0
+        target = max(int(round(self.count * percentile / 100.0)), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(max(self._value_at(index), self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'bits': self.sub_bucket_bits, 'counts': self.counts, 'count': self.count,
+                'total': self.total, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['bits'])
+        # msgpack turns int keys into ints, json into strings
+        histogram.counts = dict((int(index), count) for index, count in data['counts'].items())
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.min = data['min']
+        histogram.max = data['max']
+        return histogram
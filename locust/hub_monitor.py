@@ -0,0 +1,59 @@
+"""
+Measures how long the gevent hub is blocked.
+
+Every greenlet in a slave shares one hub, so anything that holds it, like
+decoding a large payload, delays every other greenlet and inflates the
+response times they measure. A probe greenlet sleeps for
+LOCUST_HUB_PROBE_INTERVAL seconds (default 0.1, 0 disables it) and reports
+how late it woke up as the hub:blocked request type, so a run can show that
+its timings were not skewed by the load generator itself.
+"""
+import os
+
+import gevent
+
+from stats_aggregator import report_success
+from latency import clock
+
+probe_interval = float(os.environ.get('LOCUST_HUB_PROBE_INTERVAL', 0.1))
+
+
+class HubProbe(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_blocked = 0.0
+        self.max_blocked = 0.0
+        self._window_max = 0.0
+        self._greenlet = None
+
+    def start(self):
+        if self._greenlet is None and self.interval > 0:
+            self._greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill(block=False)
+            self._greenlet = None
+
+    def take_window_max(self):
+        """The longest block since the last call, in seconds."""
+        window_max, self._window_max = self._window_max, 0.0
+        return window_max
+
+    def _run(self):
+        while True:
+            start = clock()
+            gevent.sleep(self.interval)
+            blocked = max(clock() - start - self.interval, 0.0)
+            self.last_blocked = blocked
+            self.max_blocked = max(self.max_blocked, blocked)
+            self._window_max = max(self._window_max, blocked)
+            report_success(request_type='hub:blocked', name='loop', response_time=int(blocked * 1000), response_length=0,
+                           response_time_us=blocked * 1000000)
+
+
+hub_probe = HubProbe(probe_interval)
+
+
+def start():
+    hub_probe.start()
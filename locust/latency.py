@@ -0,0 +1,123 @@
+"""
+Microsecond latency histograms for every reported stat.
+
+Locust keeps response times as whole milliseconds and rounds them further
+into 10, 100 and 1000ms steps, so sub-millisecond relay responses all show
+up as 0 and the far tail is coarse. When LOCUST_HDR_EXPORT is set to a file
+prefix, every report_success also records its duration in a Histogram per
+request type and name. Callers time with clock(), a monotonic clock, and
+pass the exact duration as response_time_us. Stats that only have whole
+milliseconds are recorded at that resolution.
+
+Slaves send their histograms to the master with every stats report and
+start over, and the master merges them. When the run ends the master (or
+the local runner) writes <prefix>_hdr.csv and <prefix>_hdr.json with the
+percentiles from p50 to p99.999 in milliseconds. The JSON also holds the
+histograms themselves, so runs can be merged later with Histogram.from_dict.
+LOCUST_HDR_BITS sets the precision (default 10, within 0.2%).
+"""
+import csv
+import json
+import logging
+import os
+import time
+
+from locust import events
+import locust.runners as runners
+
+from histogram import Histogram
+
+log = logging.getLogger(__name__)
+
+export_prefix = os.environ.get('LOCUST_HDR_EXPORT')
+enabled = bool(export_prefix)
+precision_bits = int(os.environ.get('LOCUST_HDR_BITS', 10))
+
+PERCENTILES = (50, 75, 90, 95, 99, 99.9, 99.99, 99.999)
+
+clock = time.monotonic
+
+_histograms = {}
+
+
+def record(request_type, name, micros):
+    if not enabled:
+        return
+    histogram = _histograms.get((request_type, name))
+    if histogram is None:
+        histogram = _histograms[(request_type, name)] = Histogram(precision_bits)
+    histogram.record(micros)
+
+
+def histograms():
+    return _histograms
+
+
+def _merge(request_type, name, data):
+    incoming = Histogram.from_dict(data)
+    histogram = _histograms.get((request_type, name))
+    if histogram is None:
+        _histograms[(request_type, name)] = incoming
+    else:
+        histogram.merge(incoming)
+
+
+def _percentile_label(percentile):
+    return '%g%%' % percentile
+
+
+def _ms(micros):
+    return round(micros / 1000.0, 3)
+
+
+def export(prefix):
+    rows = sorted(((key, histogram) for key, histogram in _histograms.items() if histogram.count), key=lambda row: row[0])
+    with open(prefix + '_hdr.csv', 'w') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['Type', 'Name', '# requests', 'Min', 'Average', 'Max'] +
+                        [_percentile_label(p) for p in PERCENTILES])
+        for (request_type, name), histogram in rows:
+            writer.writerow([request_type, name, histogram.count, _ms(histogram.min), _ms(histogram.mean),
+                             _ms(histogram.max)] + [_ms(histogram.value_at_percentile(p)) for p in PERCENTILES])
+    stats = []
+    for (request_type, name), histogram in rows:
+        stats.append({
+            'type': request_type,
+            'name': name,
+            'count': histogram.count,
+            'min': _ms(histogram.min),
+            'mean': _ms(histogram.mean),
+            'max': _ms(histogram.max),
+            'percentiles': dict(('%g' % p, _ms(histogram.value_at_percentile(p))) for p in PERCENTILES),
+            'histogram': histogram.to_dict(),
+        })
+    with open(prefix + '_hdr.json', 'w') as json_file:
+        json.dump({'unit': 'ms', 'histogram_unit': 'us', 'stats': stats}, json_file, indent=2)
+
+
+def _on_report_to_master(client_id, data):
+    global _histograms
+    data['hdr'] = [[request_type, name, histogram.to_dict()]
+                   for (request_type, name), histogram in _histograms.items() if histogram.count]
+    _histograms = {}
+
+
+def _on_slave_report(client_id, data):
+    for request_type, name, histogram in data.get('hdr', ()):
+        _merge(request_type, name, histogram)
+
+
+def _on_quitting():
+    if isinstance(runners.locust_runner, runners.SlaveLocustRunner):
+        return
+    try:
+        export(export_prefix)
+        log.info('wrote latency percentiles to %s_hdr.csv and %s_hdr.json', export_prefix, export_prefix)
+    except Exception as e:
+        log.error('failed to export latency percentiles: %s', e)
+
+
+if enabled:
+    events.report_to_master += _on_report_to_master
+    events.slave_report += _on_slave_report
+    events.quitting += _on_quitting
@@ -1,8 +1,10 @@
 import os
 import inspect
 import copy
+import random
+from types import MappingProxyType
 
-from locust import Locust
+from saturation import MonitoredLocust
 
 from ldclient import LDClient, Config
 from ldclient_mobile import MobileLDClient, MobileConfig
@@ -10,9 +12,14 @@ from ldclient_mobile import MobileLDClient, MobileConfig
 from locust_event_dispatcher import LocustEventDispatcher
 from locust_feature_requester import FeatureRequesterImpl as LocustServerFeatureRequester
 from locust_streaming import StreamingUpdateProcessor as LocustStreamingProcessor
+from shared_feature_store import SharedFeatureStore, INTERN_BY_VERSION, INTERN_BY_CONTENT
+from population import get_population, PopulationUser
 
+# (locust class, config class, host) -> config kwargs, see config_template
+_config_templates = {}
 
-class LaunchDarklyLocust(Locust):
+
+class LaunchDarklyLocust(MonitoredLocust):
     sdk_key = os.environ.get('LAUNCHDARKLY_SDK_KEY')
     default_user = {"anonymous": True, "key": "anonymous"}
     config_class = Config
@@ -23,6 +30,11 @@ class LaunchDarklyLocust(Locust):
     event_processor_class = LocustEventDispatcher
     feature_requester_class = LocustServerFeatureRequester
     update_processor_class = LocustStreamingProcessor
+    # optional {flag key: weight} used by random_flag_key, flags not listed have a weight of 1
+    flag_weights = None
+    # share identical flag objects between all clients in the process
+    shared_flag_store = os.environ.get('LOCUST_SHARED_FLAG_STORE') == '1'
+    shared_flag_store_intern_by = INTERN_BY_VERSION
 
     def __init__(self, *args, **kwargs):
         super(LaunchDarklyLocust, self).__init__(*args, **kwargs)
@@ -38,7 +50,12 @@ class LaunchDarklyLocust(Locust):
 
     # override this method in your subclass 
     # if you want to generate random users for each Locust instance
+    # with LOCUST_POPULATION_SIZE set, each call draws a user from the population
     def generate_user(self):
+      population = get_population(getattr(self, 'private_attribute_names', ()),
+                                  getattr(self, 'all_attributes_private', False))
+      if population is not None:
+        return population.draw()
       return self.default_user
 
     # you can override this property if you to generate random users
@@ -46,17 +63,33 @@ class LaunchDarklyLocust(Locust):
     @property
     def user(self):
       if self._user == None:
-        self._user = copy.deepcopy(self.generate_user())
+        user = self.generate_user()
+        # population users are already a fresh copy
+        self._user = user if isinstance(user, PopulationUser) else copy.deepcopy(user)
       return self._user
 
+    def config_template(self):
+        """
+        The config kwargs for this locust class. They are read from the locust's
+        attributes the first time a client is made, and reused for every client
+        after that, so set them on the class rather than per instance.
+        """
+        key = (type(self), self.config_class, self.host)
+        template = _config_templates.get(key)
+        if template is None:
+            # do you believe in magic?
+            # grab kwargs from our class attributes
+            template = _config_templates[key] = MappingProxyType({
+                arg: getattr(self, arg) for arg in \
+                        filter(lambda x: hasattr(self, x) and x not in ['self', 'return', 'user'] ,
+                            inspect.getfullargspec(self.config_class.__init__).args)
+            })
+        return template
+
     def make_config(self):
-        # do you believe in magic?
-        # grab kwargs from our class attributes
-        args = { 
-            arg: getattr(self, arg) for arg in \
-                    filter(lambda x: hasattr(self, x) and x not in ['self', 'return', 'user'] ,
-                        inspect.getfullargspec(self.config_class.__init__).args)
-        }
+        args = dict(self.config_template())
+        if self.shared_flag_store:
+            args['feature_store'] = SharedFeatureStore(intern_by=self.shared_flag_store_intern_by)
         
         return self.config_class(**args)
 
@@ -70,6 +103,18 @@ class LaunchDarklyLocust(Locust):
           self._ldclient = self.make_client()
         return self._ldclient
         
+    # picks a random flag from the keys the stream processor has seen, so
+    # task sets don't need to evaluate every flag just to choose one
+    def random_flag_key(self):
+        flag_keys = getattr(self.ldclient._update_processor, 'flag_keys', None)
+        if flag_keys:
+            return flag_keys.choice(self.flag_weights)
+        flags = list(self.all_flag_values())
+        return random.choice(flags) if flags else None
+
+    def all_flag_values(self):
+        return self.ldclient.all_flags_state(self.user).to_values_map()
+
     def close_client(self):
         try:
             if self._ldclient is not None:
@@ -87,8 +132,13 @@ class LaunchDarklyMobileLocust(LaunchDarklyLocust):
     # default classes for our mobile client are already instrumented for locust
     feature_requester_class=None 
     update_processor_class=None
+    # mobile flags are evaluated per user, so the same flag version can differ between clients
+    shared_flag_store_intern_by = INTERN_BY_CONTENT
 
     def make_client(self, user=None):
         if user is None:
           user = self.user
-        return self.client_class(user, config=self.make_config())
\ No newline at end of file
+        return self.client_class(user, config=self.make_config())
+
+    def all_flag_values(self):
+        return self.ldclient.all_flags_state().to_values_map()
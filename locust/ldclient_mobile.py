@@ -18,6 +18,7 @@ from streaming_mobile import MobileStreamingUpdateProcessor as StreamingUpdatePr
 from ldclient.util import check_uwsgi, log
 from ldclient.versioned_data_kind import FEATURES, SEGMENTS
 from client_evaluate import evaluate
+from latency import clock
 
 
 # noinspection PyBroadException
@@ -85,6 +86,12 @@ class MobileLDClient(LDClient):
         self._config._validate()
 
         self._event_processor = None
+        self._feature_requester = None
+        self._serving_previous_user = False
+        self._start_wait = start_wait
+        # set by the stream of the user passed to identify() once it has connected or given up
+        self._identify_ready = None
+        self._identify_deadline = None
         self._lock = Lock()
         self._event_factory_default = _EventFactory(False)
         self._event_factory_with_reasons = _EventFactory(True)
@@ -128,6 +135,7 @@ class MobileLDClient(LDClient):
       else:
           feature_requester = FeatureRequesterImpl(config)
       """ :type: FeatureRequester """
+      self._feature_requester = feature_requester
 
       if config.stream:
           return StreamingUpdateProcessor(config, feature_requester, store, ready)
@@ -154,18 +162,52 @@ class MobileLDClient(LDClient):
             self._send_event(self._event_factory_default.new_custom_event(event_name, user, data, metric_value))
 
   def identify(self, user):
-        """Registers the user.
-        This simply creates an analytics event that will transmit the given user properties to
-        LaunchDarkly, so that the user will be visible on your dashboard even if you have not
-        evaluated any flags for that user. It has no other effect.
+        """Switches the client to a new user.
+        Sends an identify event and reconnects the stream for the new user without waiting for
+        it. The event processor, feature store and connection pools are kept, and the previous
+        user's flags are served until the new ones arrive, or until the new stream fails or has
+        not connected within start_wait seconds. The time from this call until the new flags
+        arrive is reported as ``ld:identify``. Use :func:`wait_for_identify()` to wait for them.
         :param dict user: attributes of the user to register
         """
         if user is None or user.get('key') is None:
             raise Exception("Missing user or user key when calling identify().")
         else:
+            identify_start = clock()
             self._send_event(self._event_factory_default.new_identify_event(user))
-            self.close()
-            self.__init__(user, config=self._config)
+            self._serving_previous_user = self.is_initialized()
+            self._identify_ready = ready = threading.Event()
+            self._identify_deadline = identify_start + self._start_wait
+            self._config = self._config.copy_with_new_user(user)
+
+            previous = self._update_processor
+            previous.stop()
+            if isinstance(previous, StreamingUpdateProcessor):
+                self._feature_requester.use_config(self._config)
+                self._update_processor = StreamingUpdateProcessor(self._config, self._feature_requester, self._store,
+                    ready, http=previous.http, init_request_type='ld:identify', init_start=identify_start,
+                    flag_keys=previous.flag_keys)
+            else:
+                self._update_processor = self._make_update_processor(self._config, self._store, ready)
+            self._update_processor.start()
+
+  def wait_for_identify(self):
+        """Waits until the stream of the last identified user has connected or failed, for at most
+        start_wait seconds after the identify() call.
+        :return: whether the client is initialized for the new user
+        """
+        if self._identify_ready is not None:
+            self._identify_ready.wait(max(self._identify_deadline - clock(), 0))
+        return self.is_initialized()
+
+  def is_initialized(self):
+        if self._serving_previous_user:
+            if self._identify_ready.is_set() or clock() > self._identify_deadline:
+                # the new user's stream has connected, failed or timed out
+                self._serving_previous_user = False
+            elif self._store.initialized:
+                return True
+        return super(MobileLDClient, self).is_initialized()
 
   def toggle(self, key, default):
         """Deprecated synonym for :func:`variation()`.
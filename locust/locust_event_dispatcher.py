@@ -1,7 +1,42 @@
-from util import create_http_pool_manager
+import itertools
+import os
+
+from pool_registry import get_pool_manager
 from ldclient.event_processor import DefaultEventProcessor
+from config_mobile import MobileConfig
+import recorder
+
+# every client has its own dispatcher, so recorded SDK calls are grouped into sessions by dispatcher
+_sessions = itertools.count()
+
 
 class LocustEventDispatcher(DefaultEventProcessor):
     def __init__(self,config, http=None, dispatcher_class=None):
-        http = create_http_pool_manager(num_pools=1, verify_ssl=config.verify_ssl, target_base_uri=config.events_uri, force_proxy=config.http_proxy)
+        http = get_pool_manager(config.events_uri, verify_ssl=config.verify_ssl, force_proxy=config.http_proxy)
         super(LocustEventDispatcher, self).__init__(config, http=http, dispatcher_class=dispatcher_class)
+        if recorder.enabled:
+            self._session = '%d-%d' % (os.getpid(), next(_sessions))
+            if isinstance(config, MobileConfig):
+                recorder.record('sdk', op='open', session=self._session, sdk='mobile', user=config.user)
+            else:
+                recorder.record('sdk', op='open', session=self._session, sdk='server')
+
+    def send_event(self, event):
+        super(LocustEventDispatcher, self).send_event(event)
+        if recorder.enabled:
+            self._record_event(event)
+
+    def _record_event(self, event):
+        kind = event.get('kind')
+        if kind == 'feature' and 'prereqOf' not in event:
+            recorder.record('sdk', op='variation', session=self._session, flag=event.get('key'), user=event.get('user'))
+        elif kind == 'identify':
+            recorder.record('sdk', op='identify', session=self._session, user=event.get('user'))
+        elif kind == 'custom':
+            recorder.record('sdk', op='track', session=self._session, name=event.get('key'), user=event.get('user'),
+                            metric=event.get('metricValue'))
+
+    def stop(self):
+        if recorder.enabled and not self._closed:
+            recorder.record('sdk', op='close', session=self._session)
+        super(LocustEventDispatcher, self).stop()
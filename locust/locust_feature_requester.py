@@ -10,7 +10,7 @@ import urllib3
 from ldclient.interfaces import FeatureRequester
 from ldclient.util import UnsuccessfulResponseException
 from ldclient.util import _headers
-from util import create_http_pool_manager
+from pool_registry import get_pool_manager
 from ldclient.util import log
 from ldclient.util import throw_if_unsuccessful_response
 from ldclient.versioned_data_kind import FEATURES, SEGMENTS
@@ -25,8 +25,8 @@ CacheEntry = namedtuple('CacheEntry', ['data', 'etag'])
 class FeatureRequesterImpl(FeatureRequester):
     def __init__(self, config):
         self._cache = dict()
-        self._http = create_http_pool_manager(num_pools=1, verify_ssl=config.verify_ssl,
-            target_base_uri=config.base_uri, force_proxy=config.http_proxy)
+        self._http = get_pool_manager(config.base_uri, verify_ssl=config.verify_ssl,
+            force_proxy=config.http_proxy)
         self._config = config
 
     def get_all_data(self):
@@ -5,7 +5,6 @@ Default implementation of the streaming component.
 
 from collections import namedtuple
 
-import json
 from threading import Thread
 
 import backoff
@@ -17,7 +16,12 @@ from sse_client import SSEClient
 from ldclient.util import _stream_headers, log, UnsuccessfulResponseException, http_error_message, is_http_error_recoverable
 from ldclient.versioned_data_kind import FEATURES, SEGMENTS
 from locust_feature_requester import FeatureRequesterImpl
-from locust.events import request_success, request_failure
+from flag_index import FlagKeyIndex
+from payload_cache import decode
+from propagation import record_propagation
+from locust.events import request_failure
+from stats_aggregator import report_success
+from latency import clock
 
 # allows for up to 5 minutes to elapse without any data sent across the stream. The heartbeats sent as comments on the
 # stream will keep this from triggering
@@ -38,6 +42,8 @@ class StreamingUpdateProcessor(Thread, UpdateProcessor):
         self._store = store
         self._running = False
         self._ready = ready
+        self._sse = None
+        self.flag_keys = FlagKeyIndex()
 
         # We need to suppress the default logging behavior of the backoff package, because
         # it logs messages at ERROR level with variable content (the delay time) which will
@@ -54,27 +60,28 @@ class StreamingUpdateProcessor(Thread, UpdateProcessor):
         self._running = True
         while self._running:
             try:
-                init_start = time.time()
+                init_start = clock()
                 messages = self._connect()
                 for msg in messages:
                     if not self._running:
                         break
-                    message_ok = self.process_message(self._store, self._requester, msg)
+                    message_ok = self.process_message(self._store, self._requester, msg, self.flag_keys)
                     if message_ok is True and self._ready.is_set() is False:
                         log.info("StreamingUpdateProcessor initialized ok.")
-                        init_duration = int((time.time() - init_start) * 1000)
-                        request_success.fire(request_type="ld:init", name="server", response_time=init_duration, response_length=0)
+                        init_duration = clock() - init_start
+                        report_success(request_type="ld:init", name="server", response_time=int(init_duration * 1000), response_length=0,
+                                       response_time_us=init_duration * 1000000)
                         self._ready.set()
             except UnsuccessfulResponseException as e:
                 log.error(http_error_message(e.status, "stream connection"))
-                init_duration = int((time.time() - init_start) * 1000)
+                init_duration = int((clock() - init_start) * 1000)
                 request_failure.fire(request_type="ld:init", name="server", response_time=init_duration, response_length=0, exception=e)
                 if not is_http_error_recoverable(e.status):
                     self._ready.set()  # if client is initializing, make it stop waiting; has no effect if already inited
                     self.stop()
                     break
             except Exception as e:
-                init_duration = int((time.time() - init_start) * 1000)
+                init_duration = int((clock() - init_start) * 1000)
                 request_failure.fire(request_type="ld:init", name="server", response_time=init_duration, response_length=0, exception=e)
                 log.warning("Caught exception. Restarting stream connection after one second. %s" % e)
                 # no stacktrace here because, for a typical connection error, it'll just be a lengthy tour of urllib3 internals
@@ -93,26 +100,32 @@ class StreamingUpdateProcessor(Thread, UpdateProcessor):
     @backoff.on_exception(_backoff_expo, BaseException, max_tries=None, jitter=backoff.full_jitter,
                           on_backoff=log_backoff_message, giveup=should_not_retry)
     def _connect(self):
-        return SSEClient(
+        self._sse = SSEClient(
             self._uri,
             headers=_stream_headers(self._config.sdk_key),
             connect_timeout=self._config.connect_timeout,
             read_timeout=stream_read_timeout,
             verify_ssl=self._config.verify_ssl,
-            http_proxy=self._config.http_proxy)
+            http_proxy=self._config.http_proxy,
+            owner=self)
+        return self._sse
 
     def stop(self):
         log.info("Stopping StreamingUpdateProcessor")
         self._running = False
+        if self._sse is not None:
+            self._sse.close()
 
     def initialized(self):
         return self._running and self._ready.is_set() is True and self._store.initialized is True
 
     # Returns True if we initialized the feature store
     @staticmethod
-    def process_message(store, requester, msg):
+    def process_message(store, requester, msg, flag_keys=None):
+        if flag_keys is None:
+            flag_keys = FlagKeyIndex()
         if msg.event == 'put':
-            all_data = json.loads(msg.data)
+            all_data = decode('put', msg.data)
             init_data = {
                 FEATURES: all_data['data']['flags'],
                 SEGMENTS: all_data['data']['segments']
@@ -120,10 +133,11 @@ class StreamingUpdateProcessor(Thread, UpdateProcessor):
             log.debug("Received put event with %d flags and %d segments",
                 len(init_data[FEATURES]), len(init_data[SEGMENTS]))
             store.init(init_data)
+            flag_keys.reset(init_data[FEATURES])
             return True
         elif msg.event == 'patch':
             recv_time = time.time() * 1000
-            payload = json.loads(msg.data)
+            payload = decode('patch', msg.data)
             path = payload['path']
             obj = payload['data']
             log.debug("Received patch event for %s, New version: [%d]", path, obj.get("version"))
@@ -131,11 +145,12 @@ class StreamingUpdateProcessor(Thread, UpdateProcessor):
             
             if target is not None:
                 store.upsert(target.kind, obj)
+                if target.kind == FEATURES:
+                    flag_keys.add(target.key)
                 if target.kind.namespace == 'features' and target.key == 'locust-heartbeat':
                     time_start = obj.get('variations', [None])[0]
                     if time_start is not None:
-                        duration = int(recv_time - time_start)
-                        request_success.fire(request_type='sse:flag-update', name='/all', response_time=duration, response_length=0)
+                        record_propagation('/all', time_start, recv_time)
             else:
                 log.warning("Patch for unknown path: %s", path)
         elif msg.event == "indirect/patch":
@@ -144,14 +159,18 @@ class StreamingUpdateProcessor(Thread, UpdateProcessor):
             target = StreamingUpdateProcessor._parse_path(path)
             if target is not None:
                 store.upsert(target.kind, requester.get_one(target.kind, target.key))
+                if target.kind == FEATURES:
+                    flag_keys.add(target.key)
             else:
                 log.warning("Indirect patch for unknown path: %s", path)
         elif msg.event == "indirect/put":
             log.debug("Received indirect/put event")
-            store.init(requester.get_all_data())
+            all_data = requester.get_all_data()
+            store.init(all_data)
+            flag_keys.reset(all_data[FEATURES])
             return True
         elif msg.event == 'delete':
-            payload = json.loads(msg.data)
+            payload = decode('delete', msg.data)
             path = payload['path']
             # noinspection PyShadowingNames
             version = payload['version']
@@ -159,6 +178,8 @@ class StreamingUpdateProcessor(Thread, UpdateProcessor):
             target = StreamingUpdateProcessor._parse_path(path)
             if target is not None:
                 store.delete(target.kind, target.key, version)
+                if target.kind == FEATURES:
+                    flag_keys.remove(target.key)
             else:
                 log.warning("Delete for unknown path: %s", path)
         else:
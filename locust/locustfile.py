@@ -2,7 +2,6 @@ import os
 import sys
 import logging
 import gevent
-import random
 import gevent
 import json
 import time
@@ -18,6 +17,8 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from util import create_http_pool_manager
 from launchdarkly_locust import LaunchDarklyLocust, LaunchDarklyMobileLocust
+from open_loop import OpenLoopTaskSet
+import population
 
 log = logging.getLogger()
 log.setLevel(logging.DEBUG)
@@ -49,21 +50,25 @@ class LaunchDarklyMobileTaskSet(TaskSequence):
             # evaluate a random flag
             # replace this with self.locust.variation(flag, default) calls
             # that match a realistic workload
-            flags = self.locust.ldclient.all_flags_state().to_values_map()
-            flag, value = random.choice(list(flags.items()))
+            flag = self.locust.random_flag_key()
             log.debug('evaluating flag %s', flag)
             self.locust.ldclient.variation(flag, None)
         @task(8)
         def reindentify(self):
             ##  re-identify with new properties
-            self.locust.ldclient.identify({
-                "key": "anonymous",
-                "anonymous": True,
-                "custom": {
-                    "groups": ["admin"]
+            ##  or as another user from the population, if there is one
+            if population.enabled:
+                user = self.locust.generate_user()
+            else:
+                user = {
+                    "key": "anonymous",
+                    "anonymous": True,
+                    "custom": {
+                        "groups": ["admin"]
+                    }
                 }
-            })
-            if not self.locust.ldclient.is_initialized():
+            self.locust.ldclient.identify(user)
+            if not self.locust.ldclient.wait_for_identify():
                 log.debug('failed to initialize after re-identify')
                 self.locust.close_client()
         @task(3)
@@ -99,8 +104,7 @@ class LaunchDarklyServerTaskSet(TaskSequence):
         wait_time = between(1, 30)
         @task(10)
         def evaluate_flags(self):
-            flags = self.locust.ldclient.all_flags_state(self.locust.user).to_values_map()
-            flag, value = random.choice(list(flags.items()))
+            flag = self.locust.random_flag_key()
             log.debug('evaluating flag %s', flag)
             self.locust.ldclient.variation(flag,self.locust.user, None)
         @task(3)
@@ -116,21 +120,71 @@ class LaunchDarklyServerTaskSet(TaskSequence):
     def on_stop(self):
         self.locust.close_client()
 
+# open-loop versions of the task sets above
+# once initialized, the clients evaluate flags and track events at
+# LOCUST_OPEN_LOOP_RATE per second per worker, however slow the relay gets
+# see open_loop.py for details
+class LaunchDarklyOpenLoopServerTaskSet(TaskSequence):
+    wait_time = between(1, 30)
+
+    @seq_task(1)
+    def init_ldclient(self):
+        if not self.locust.ldclient.is_initialized():
+            self.locust.close_client()
+            raise Exception('failed to initialize client')
+    @seq_task(2)
+    class LDServerTasks(OpenLoopTaskSet):
+        @task(10)
+        def evaluate_flags(self):
+            self.locust.ldclient.variation(self.locust.random_flag_key(), self.locust.user, None)
+        @task(3)
+        def track_event(self):
+            self.locust.ldclient.track('test_event', self.locust.user, metric_value=1)
+
+    def on_stop(self):
+        self.locust.close_client()
+
+class LaunchDarklyOpenLoopMobileTaskSet(TaskSequence):
+    wait_time = between(1, 30)
+
+    @seq_task(1)
+    def init_ldclient(self):
+        if not self.locust.ldclient.is_initialized():
+            self.locust.close_client()
+            raise Exception('failed to initialize client')
+    @seq_task(2)
+    class LDMobileTasks(OpenLoopTaskSet):
+        # no re-identify: tasks on the same client can overlap
+        @task(10)
+        def evaluate_flags(self):
+            self.locust.ldclient.variation(self.locust.random_flag_key(), None)
+        @task(3)
+        def track_event(self):
+            self.locust.ldclient.track('test_event', metric_value=1)
+
+    def on_stop(self):
+        self.locust.close_client()
+
+
 
 
             
 
 class LaunchDarklyBasicServer(LaunchDarklyLocust):
     task_set = LaunchDarklyServerTaskSet
+    # task_set = LaunchDarklyOpenLoopServerTaskSet for a constant arrival rate
     weight = 1
 
     
 class LaunchDarklyBasicMobile(LaunchDarklyMobileLocust):
     weight = 2
     task_set = LaunchDarklyMobileTaskSet
+    # task_set = LaunchDarklyOpenLoopMobileTaskSet for a constant arrival rate
     # you can define any properties normally passed to LDClient.Config here
     # for example
     # evaluation_reasons=True
+    # flags evaluated by random_flag_key() are picked uniformly unless weighted
+    # flag_weights = {'my-hot-flag': 50}
 
 
 
@@ -0,0 +1,244 @@
+"""
+Local stand-in for LD-Relay, for benchmarking the load generator without a
+relay or LaunchDarkly credentials.
+
+Serves the endpoints the locustfile uses:
+
+- GET /all: server-side stream, a put with every flag and segment and then
+  a patch for every change
+- GET /meval/<user> and REPORT /meval: mobile stream, a put with the flags
+  evaluated for the user and then a patch for every change
+- GET /sdk/latest-all, /sdk/latest-flags/<key> and /sdk/latest-segments/<key>
+- GET /msdk/evalx/users/<user> and REPORT /msdk/evalx/user
+- POST to any other path is accepted as an event payload
+
+Polling endpoints send an ETag and answer If-None-Match with a 304. Streams
+send a heartbeat comment every --heartbeat-interval seconds. Random flags are
+changed --patch-rate times per second, and the locust-heartbeat flag is set
+to the current time every --heartbeat-flag-interval seconds, the way the
+locustfile's heartbeat thread does through the LaunchDarkly API, so
+sse:flag-update is reported without LaunchDarkly too.
+
+Flags are evaluated for mobile users by hashing the user and flag keys, which
+is stable per user but doesn't implement targeting. Usage:
+
+    python locust/mock_relay.py [--port 8030] [--flags 100] [--segments 10] [--flag-size 0]
+                                [--patch-rate 1] [--heartbeat-interval 15] [--heartbeat-flag-interval 30]
+
+and point LAUNCHDARKLY_BASE_URI, LAUNCHDARKLY_EVENTS_URI,
+LAUNCHDARKLY_STREAM_URI and LAUNCHDARKLY_MOBILE_STREAM_URI at it.
+"""
+import argparse
+import json
+import logging
+import random
+import time
+import zlib
+from base64 import urlsafe_b64decode
+
+import gevent
+from gevent.pywsgi import WSGIServer
+from gevent.queue import Queue, Empty
+
+log = logging.getLogger('mock_relay')
+
+HEARTBEAT_FLAG = 'locust-heartbeat'
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _decode_user(b64):
+    b64 = b64 + '=' * (-len(b64) % 4)
+    return json.loads(urlsafe_b64decode(b64.encode('utf-8')).decode('utf-8'))
+
+
+class FlagData(object):
+    """The flags and segments the mock serves, and the streams to update."""
+
+    def __init__(self, num_flags=100, num_segments=10, flag_size=0):
+        self.version = 1
+        self.flags = {}
+        self.segments = {}
+        self.subscribers = set()
+        self._all_data = None
+        self._padding = 'x' * max(flag_size - 400, 0)
+        for i in range(num_segments):
+            key = 'segment-%d' % i
+            self.segments[key] = {'key': key, 'version': 1, 'included': ['user-%d' % i], 'excluded': [],
+                                  'rules': [], 'salt': key, 'deleted': False}
+        for i in range(num_flags):
+            self.flags['flag-%d' % i] = self._make_flag('flag-%d' % i, [True, False])
+        now = int(time.time() * 1000)
+        self.flags[HEARTBEAT_FLAG] = self._make_flag(HEARTBEAT_FLAG, [now, now + 1])
+
+    def _make_flag(self, key, variations):
+        clauses = [{'attribute': 'email', 'op': 'endsWith', 'values': ['@example.com'], 'negate': False}]
+        if self._padding:
+            clauses.append({'attribute': 'padding', 'op': 'in', 'values': [self._padding], 'negate': False})
+        return {'key': key, 'version': self.version, 'on': True, 'variations': variations, 'salt': key,
+                'fallthrough': {'variation': 0}, 'offVariation': 1, 'targets': [], 'prerequisites': [],
+                'rules': [{'id': key + '-rule', 'clauses': clauses, 'variation': 1}],
+                'trackEvents': False, 'debugEventsUntilDate': None, 'deleted': False}
+
+    @property
+    def etag(self):
+        return '"%d"' % self.version
+
+    def all_data(self):
+        # the payload only changes with the version, so it is serialized once
+        if self._all_data is None or self._all_data[0] != self.version:
+            self._all_data = (self.version, _dumps({'flags': self.flags, 'segments': self.segments}))
+        return self._all_data[1]
+
+    def evaluate(self, user):
+        user_key = str(user.get('key', ''))
+        return dict((key, self.evaluate_flag(flag, user_key)) for key, flag in self.flags.items())
+
+    def evaluate_flag(self, flag, user_key):
+        variations = flag['variations']
+        variation = zlib.crc32((user_key + flag['key']).encode('utf-8')) % len(variations)
+        if flag['key'] == HEARTBEAT_FLAG:
+            variation = 0
+        return {'key': flag['key'], 'value': variations[variation], 'variation': variation,
+                'version': flag['version'], 'flagVersion': flag['version'], 'trackEvents': False}
+
+    def update(self, key, variations=None):
+        flag = self.flags[key]
+        self.version += 1
+        self.flags[key] = self._make_flag(key, variations or flag['variations'])
+        for queue in list(self.subscribers):
+            queue.put(key)
+
+
+class MockRelay(object):
+    def __init__(self, data, heartbeat_interval=15):
+        self.data = data
+        self.heartbeat_interval = heartbeat_interval
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        path = environ.get('PATH_INFO', '')
+        try:
+            if path == '/all' and method == 'GET':
+                return self._stream(start_response, None)
+            if path.startswith('/meval'):
+                return self._stream(start_response, self._mobile_user(environ, method, path, '/meval'))
+            if path == '/sdk/latest-all' and method == 'GET':
+                return self._poll(environ, start_response, self.data.etag, self.data.all_data)
+            if path.startswith('/sdk/latest-flags/') or path.startswith('/sdk/latest-segments/'):
+                return self._get_one(start_response, path)
+            if path.startswith('/msdk/evalx'):
+                user = self._mobile_user(environ, method, path, '/msdk/evalx/users', '/msdk/evalx/user')
+                etag = '"%d-%x"' % (self.data.version, zlib.crc32(str(user.get('key', '')).encode('utf-8')))
+                return self._poll(environ, start_response, etag, lambda: _dumps(self.data.evaluate(user)))
+            if method == 'POST':
+                environ['wsgi.input'].read()
+                return self._respond(start_response, '202 Accepted', b'')
+        except (ValueError, KeyError) as e:
+            return self._respond(start_response, '400 Bad Request', str(e).encode('utf-8'))
+        return self._respond(start_response, '404 Not Found', b'')
+
+    def _respond(self, start_response, status, body, headers=None):
+        start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))] + (headers or []))
+        return [body]
+
+    def _mobile_user(self, environ, method, path, get_prefix, report_path=None):
+        if method == 'REPORT' and path in (get_prefix, report_path):
+            return json.loads(environ['wsgi.input'].read().decode('utf-8'))
+        if method == 'GET' and path.startswith(get_prefix + '/'):
+            return _decode_user(path[len(get_prefix) + 1:])
+        raise ValueError('unknown mobile request %s %s' % (method, path))
+
+    def _poll(self, environ, start_response, etag, body):
+        if environ.get('HTTP_IF_NONE_MATCH') == etag:
+            start_response('304 Not Modified', [('ETag', etag)])
+            return [b'']
+        return self._respond(start_response, '200 OK', body(), [('ETag', etag)])
+
+    def _get_one(self, start_response, path):
+        kind, key = path[len('/sdk/'):].split('/', 1)
+        items = self.data.flags if kind == 'latest-flags' else self.data.segments
+        if key not in items:
+            return self._respond(start_response, '404 Not Found', b'')
+        return self._respond(start_response, '200 OK', _dumps(items[key]))
+
+    def _stream(self, start_response, user):
+        start_response('200 OK', [('Content-Type', 'text/event-stream'), ('Cache-Control', 'no-cache')])
+        return self._events(user)
+
+    def _events(self, user):
+        data = self.data
+        queue = Queue()
+        data.subscribers.add(queue)
+        try:
+            if user is None:
+                yield b'event: put\ndata: {"path":"/","data":' + data.all_data() + b'}\n\n'
+            else:
+                yield b'event: put\ndata: ' + _dumps(data.evaluate(user)) + b'\n\n'
+            user_key = None if user is None else str(user.get('key', ''))
+            next_heartbeat = time.time() + self.heartbeat_interval
+            while True:
+                try:
+                    key = queue.get(timeout=max(next_heartbeat - time.time(), 0))
+                except Empty:
+                    key = None
+                # heartbeats are sent on schedule even while patches flow, like the relay does
+                if time.time() >= next_heartbeat:
+                    next_heartbeat = time.time() + self.heartbeat_interval
+                    yield b':\n\n'
+                if key is None:
+                    continue
+                flag = data.flags[key]
+                if user_key is None:
+                    payload = {'path': '/flags/' + key, 'data': flag}
+                else:
+                    payload = data.evaluate_flag(flag, user_key)
+                yield b'event: patch\ndata: ' + _dumps(payload) + b'\n\n'
+        finally:
+            data.subscribers.discard(queue)
+
+
+def _patch_forever(data, rate):
+    keys = [key for key in data.flags if key != HEARTBEAT_FLAG]
+    while keys:
+        gevent.sleep(1.0 / rate)
+        data.update(random.choice(keys))
+
+
+def _heartbeat_flag_forever(data, interval):
+    while True:
+        gevent.sleep(interval)
+        now = int(time.time() * 1000)
+        data.update(HEARTBEAT_FLAG, [now, now + 1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8030)
+    parser.add_argument('--flags', type=int, default=100)
+    parser.add_argument('--segments', type=int, default=10)
+    parser.add_argument('--flag-size', type=int, default=0,
+                        help='pad every server-side flag to about this many bytes of json')
+    parser.add_argument('--patch-rate', type=float, default=1,
+                        help='random flag changes per second, 0 to disable')
+    parser.add_argument('--heartbeat-interval', type=float, default=15,
+                        help='seconds between stream heartbeat comments')
+    parser.add_argument('--heartbeat-flag-interval', type=float, default=30,
+                        help='seconds between locust-heartbeat updates, 0 to disable')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    data = FlagData(num_flags=args.flags, num_segments=args.segments, flag_size=args.flag_size)
+    if args.patch_rate > 0:
+        gevent.spawn(_patch_forever, data, args.patch_rate)
+    if args.heartbeat_flag_interval > 0:
+        gevent.spawn(_heartbeat_flag_forever, data, args.heartbeat_flag_interval)
+    log.info('serving %d flags (%d bytes) on %s:%d', len(data.flags), len(data.all_data()), args.host, args.port)
+    WSGIServer((args.host, args.port), MockRelay(data, args.heartbeat_interval), log=None).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
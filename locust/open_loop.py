@@ -0,0 +1,144 @@
+"""
+Open-loop task sets.
+
+A regular TaskSet waits for wait_time after each task, so when the relay
+slows down every locust slows down with it and the offered load drops, which
+hides exactly the saturation we are looking for (coordinated omission).
+
+The tasks of an OpenLoopTaskSet are started by one scheduler per task set
+class and worker instead, at a fixed aggregate rate no matter how long the
+earlier ones take. Each arrival runs a task, picked by weight, on a random
+locust that has started the task set. Arrivals are a Poisson process by
+default, or evenly spaced. Every task is reported as open-loop, named after
+the task, with the time from its intended start to its end, so time spent
+waiting for the scheduler or for a free worker is counted. Settings, per
+worker:
+
+- LOCUST_OPEN_LOOP_RATE: tasks per second (default 100)
+- LOCUST_OPEN_LOOP_ARRIVALS: poisson or fixed (default poisson)
+- LOCUST_OPEN_LOOP_CONCURRENCY: tasks that can run at once (default 1000)
+"""
+import logging
+import os
+import random
+
+import gevent
+from gevent.pool import Pool
+
+from locust import TaskSet
+from locust.events import request_failure
+from locust.exception import InterruptTaskSet
+
+from stats_aggregator import report_success
+from latency import clock
+
+log = logging.getLogger(__name__)
+
+ARRIVALS_POISSON = 'poisson'
+ARRIVALS_FIXED = 'fixed'
+
+# one scheduler per task set class
+_schedulers = {}
+
+
+class ArrivalSchedule(object):
+    """
+    Intended start times at the given rate. They are computed from the first
+    arrival rather than from when the previous task ran, so they don't drift
+    when the scheduler falls behind.
+    """
+
+    def __init__(self, rate, arrivals=ARRIVALS_POISSON, rng=None):
+        if arrivals not in (ARRIVALS_POISSON, ARRIVALS_FIXED):
+            raise ValueError('unknown arrivals %r' % arrivals)
+        self.rate = rate
+        self.arrivals = arrivals
+        self._rng = rng or random.Random()
+        self._next = clock()
+
+    def next(self):
+        intended = self._next
+        if self.arrivals == ARRIVALS_POISSON:
+            self._next += self._rng.expovariate(self.rate)
+        else:
+            self._next += 1.0 / self.rate
+        return intended
+
+
+class OpenLoopScheduler(object):
+    def __init__(self, rate, arrivals=ARRIVALS_POISSON, concurrency=1000):
+        self.rate = rate
+        self.arrivals = arrivals
+        self._task_sets = []
+        self._workers = Pool(concurrency)
+        self._greenlet = None
+
+    def add(self, task_set):
+        self._task_sets.append(task_set)
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._run)
+
+    def remove(self, task_set):
+        self._task_sets.remove(task_set)
+
+    def _execute(self, task_set, task, intended):
+        name = getattr(task, '__name__', str(task))
+        try:
+            task_set.execute_task(task)
+        except InterruptTaskSet:
+            # there is no parent to hand over to, the locust keeps its place in the schedule
+            pass
+        except Exception as e:
+            request_failure.fire(request_type='open-loop', name=name, response_time=int((clock() - intended) * 1000), response_length=0, exception=e)
+        else:
+            elapsed = clock() - intended
+            report_success(request_type='open-loop', name=name, response_time=int(elapsed * 1000), response_length=0,
+                           response_time_us=elapsed * 1000000)
+
+    def _run(self):
+        schedule = ArrivalSchedule(self.rate, self.arrivals)
+        while self._task_sets:
+            intended = schedule.next()
+            delay = intended - clock()
+            if delay > 0:
+                gevent.sleep(delay)
+            if not self._task_sets:
+                break
+            task_set = random.choice(self._task_sets)
+            # blocks while every worker is busy, the time spent waiting still counts towards the latency
+            self._workers.spawn(self._execute, task_set, random.choice(task_set.tasks), intended)
+        # started again with a fresh schedule when the next locust arrives
+        self._greenlet = None
+
+
+def get_scheduler(task_set_class):
+    scheduler = _schedulers.get(task_set_class)
+    if scheduler is None:
+        scheduler = _schedulers[task_set_class] = OpenLoopScheduler(
+            task_set_class.rate, task_set_class.arrivals, task_set_class.concurrency)
+    return scheduler
+
+
+class OpenLoopTaskSet(TaskSet):
+    """
+    A TaskSet whose tasks are run by the open-loop scheduler instead of after
+    wait_time. It can be used wherever a TaskSet can, for example as the
+    task set a TaskSequence moves on to once its client is initialized.
+    It stays active until the locust is stopped.
+    """
+    rate = float(os.environ.get('LOCUST_OPEN_LOOP_RATE', 100))
+    arrivals = os.environ.get('LOCUST_OPEN_LOOP_ARRIVALS', ARRIVALS_POISSON)
+    concurrency = int(os.environ.get('LOCUST_OPEN_LOOP_CONCURRENCY', 1000))
+
+    def run(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        if hasattr(self, 'on_start'):
+            self.on_start()
+        scheduler = get_scheduler(type(self))
+        scheduler.add(self)
+        try:
+            while True:
+                gevent.sleep(60)
+        finally:
+            scheduler.remove(self)
@@ -0,0 +1,186 @@
+"""
+Decode-once cache for stream payloads.
+
+When a flag changes, every client in the worker receives the same put/patch
+bytes and would decode them separately. decode() keeps the most recently
+decoded payloads in a bounded LRU keyed by a hash of the raw data, so each
+distinct payload is decoded once per process. Hits are confirmed against the
+raw data, so a hash collision can only cost a decode.
+
+Decoded payloads are shared between clients and must be treated as
+read-only. Work that changes a payload, like copying keys into mobile flags,
+belongs in a transform so it is done once before the result is cached.
+
+Decoding holds the gevent hub, which delays every other greenlet and inflates
+their timings. Payloads of at least LOCUST_DECODE_OFFLOAD_BYTES (default
+65536, 0 disables offloading) are decoded on gevent's thread pool while the
+calling greenlet waits, and clients that receive the same payload while it
+is being decoded wait for that result instead of decoding it again. See
+hub_monitor for how blocked time is reported.
+
+Every lookup is reported as decode:hit, decode:miss or decode:offload named
+after the event, with the time it took and the payload size.
+LOCUST_PAYLOAD_CACHE_SIZE sets how many payloads are kept (default 32, 0
+disables the cache).
+"""
+import gc
+import json
+import json.decoder
+import json.scanner
+import os
+from collections import OrderedDict
+
+import gevent
+from gevent.event import AsyncResult
+
+from stats_aggregator import report_success
+from latency import clock
+
+_c_scan_once = json.scanner.make_scanner(json.JSONDecoder())
+
+
+def _make_yielding_scanner(depth, memo):
+    # json's C decoder holds the GIL for the whole document, so running it on
+    # a thread does not let the hub run. The outer objects are walked in
+    # python instead, which gives the interpreter a chance to switch threads
+    # between members, and each member below that is decoded in C.
+    if depth == 0:
+        return _c_scan_once
+
+    inner = _make_yielding_scanner(depth - 1, memo)
+
+    def scan_once(s, idx):
+        if s[idx:idx + 1] == '{':
+            return json.decoder.JSONObject((s, idx + 1), True, inner, None, None, memo)
+        return _c_scan_once(s, idx)
+    return scan_once
+
+
+def yielding_loads(data, depth=3):
+    """
+    Same result as json.loads, for decoding on a thread without holding the
+    GIL for the whole payload. depth is how many object levels are walked in
+    python, 3 reaches the individual flags of a server put.
+    """
+    s = data.decode('utf-8') if isinstance(data, bytes) else data
+    scan_once = _make_yielding_scanner(depth, {})
+    start = json.decoder.WHITESPACE.match(s, 0).end()
+    try:
+        obj, end = scan_once(s, start)
+    except StopIteration as err:
+        raise json.JSONDecodeError('Expecting value', s, err.value)
+    end = json.decoder.WHITESPACE.match(s, end).end()
+    if end != len(s):
+        raise json.JSONDecodeError('Extra data', s, end)
+    return obj
+
+
+# offloaded decodes in progress, and whether the collector was on before the first
+_paused = {'count': 0, 'gc_enabled': False}
+
+
+def _pause_gc():
+    # a large payload allocates enough objects to trigger collections that walk
+    # everything with the GIL held, which blocks the hub for longer than the
+    # decode itself. Only the hub pauses and resumes the collector, so
+    # overlapping offloads just keep it paused until the last one is done.
+    if _paused['count'] == 0:
+        _paused['gc_enabled'] = gc.isenabled()
+        gc.disable()
+    _paused['count'] += 1
+
+
+def _resume_gc():
+    _paused['count'] -= 1
+    if _paused['count'] == 0 and _paused['gc_enabled']:
+        gc.enable()
+
+
+def _load(loads, data, transform):
+    decoded = loads(data)
+    if transform is not None:
+        decoded = transform(decoded)
+    return decoded
+
+
+class PayloadCache(object):
+    def __init__(self, max_entries=32, offload_bytes=65536):
+        self.max_entries = max_entries
+        self.offload_bytes = offload_bytes
+        self.hits = 0
+        self.misses = 0
+        self.offloaded = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_entries=int(os.environ.get('LOCUST_PAYLOAD_CACHE_SIZE', 32)),
+                   offload_bytes=int(os.environ.get('LOCUST_DECODE_OFFLOAD_BYTES', 65536)))
+
+    def _should_offload(self, data):
+        return self.offload_bytes > 0 and len(data) >= self.offload_bytes
+
+    def _decode(self, data, transform):
+        if self._should_offload(data):
+            _pause_gc()
+            try:
+                return gevent.get_hub().threadpool.apply(_load, (yielding_loads, data, transform))
+            finally:
+                _resume_gc()
+        return _load(json.loads, data, transform)
+
+    def decode(self, name, data, transform=None):
+        start_time = clock()
+        if self.max_entries <= 0:
+            return self._decode(data, transform)
+
+        key = (transform, hash(data))
+        entry = self._entries.get(key) or self._pending.get(key)
+        if entry is not None and entry[0] == data:
+            decoded = entry[1]
+            if isinstance(decoded, AsyncResult):
+                decoded = decoded.get()
+            else:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            elapsed = clock() - start_time
+            report_success(request_type='decode:hit', name=name, response_time=int(elapsed * 1000), response_length=len(data),
+                           response_time_us=elapsed * 1000000)
+            return decoded
+
+        if self._should_offload(data):
+            request_type = 'decode:offload'
+            self.offloaded += 1
+            result = AsyncResult()
+            self._pending[key] = (data, result)
+            try:
+                decoded = self._decode(data, transform)
+            except BaseException as e:
+                result.set_exception(e)
+                raise
+            else:
+                result.set(decoded)
+            finally:
+                if self._pending.get(key, (None, None))[1] is result:
+                    del self._pending[key]
+        else:
+            request_type = 'decode:miss'
+            decoded = self._decode(data, transform)
+
+        self._entries[key] = (data, decoded)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self.misses += 1
+        elapsed = clock() - start_time
+        report_success(request_type=request_type, name=name, response_time=int(elapsed * 1000), response_length=len(data),
+                       response_time_us=elapsed * 1000000)
+        return decoded
+
+
+payload_cache = PayloadCache.from_env()
+
+
+def decode(name, data, transform=None):
+    return payload_cache.decode(name, data, transform)
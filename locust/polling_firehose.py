@@ -0,0 +1,222 @@
+"""
+Polling workload driven by one scheduler per worker.
+
+With stream=False every SDK client runs its own PollingUpdateProcessor
+thread and timer, and MobileConfig won't poll more often than every 30
+seconds, so polling load can't scale. PollingFirehoseLocust instead
+registers pollers_per_locust virtual pollers with a process-wide timing
+wheel. The wheel wakes up every LOCUST_POLL_TICK seconds (default 0.05) and
+polls everything that is due on a bounded pool of greenlets
+(LOCUST_POLL_CONCURRENCY, default 200) over shared sockets. Each poller
+repeats every LOCUST_POLL_INTERVAL seconds (default 30), give or take
+LOCUST_POLL_JITTER of it (default 0.1).
+
+Pollers send the ETag of their last response in If-None-Match. Every poll is
+reported as a poll request, and its outcome separately: poll:200 with the
+body size, or poll:304 with the bytes the relay didn't have to resend.
+"""
+import json
+import logging
+import os
+import random
+from base64 import urlsafe_b64encode
+
+import gevent
+from gevent.pool import Pool
+
+from locust import TaskSet, task, constant
+
+from util import _headers, clean_name
+from pool_registry import PoolRegistry, POOL_MODE_SHARED, registry
+from stats_aggregator import report_success
+from population import get_population, PopulationUser
+from latency import clock
+from saturation import MonitoredLocust
+
+log = logging.getLogger(__name__)
+
+
+class TimingWheel(object):
+    """
+    Hashed timing wheel. Scheduling and cancelling are O(1), and each tick
+    only looks at the entries in one slot. Entries more than one turn of the
+    wheel away wait in their slot for the remaining turns.
+    """
+
+    def __init__(self, tick=0.05, num_slots=1024):
+        self.tick = tick
+        self._slots = [[] for _ in range(num_slots)]
+        self._current = 0
+        self._started_at = None
+        self._ticks = 0
+
+    def schedule(self, item, delay):
+        ticks = max(int(round(delay / self.tick)), 1)
+        self._slots[(self._current + ticks) % len(self._slots)].append([(ticks - 1) // len(self._slots), item])
+
+    def advance(self):
+        """Moves to the next slot and returns the items that are due."""
+        self._current = (self._current + 1) % len(self._slots)
+        slot = self._slots[self._current]
+        due = [item for rounds, item in slot if rounds == 0]
+        waiting = [entry for entry in slot if entry[0] > 0]
+        for entry in waiting:
+            entry[0] -= 1
+        self._slots[self._current] = waiting
+        return due
+
+    def due_ticks(self):
+        """How many ticks have passed since the last call, without drifting."""
+        now = clock()
+        if self._started_at is None:
+            self._started_at = now
+        elapsed = int((now - self._started_at) / self.tick)
+        ticks, self._ticks = elapsed - self._ticks, elapsed
+        return ticks
+
+
+class Poller(object):
+    __slots__ = ('http', 'method', 'url', 'name', 'headers', 'body', 'etag', 'cached_size', 'cancelled')
+
+    def __init__(self, http, url, headers, method='GET', body=None):
+        self.http = http
+        self.method = method
+        self.url = url
+        self.name = clean_name(method, url)
+        self.headers = headers
+        self.body = body
+        self.etag = None
+        self.cached_size = 0
+        self.cancelled = False
+
+    def poll(self):
+        headers = self.headers
+        if self.etag is not None:
+            headers = dict(headers)
+            headers['If-None-Match'] = self.etag
+        start_time = clock()
+        resp = self.http.request(self.method, self.url, headers=headers, body=self.body, retries=1,
+                                 request_type='poll')
+        elapsed = clock() - start_time
+        if resp.status == 304:
+            report_success(request_type='poll:304', name=self.name, response_time=int(elapsed * 1000), response_length=self.cached_size,
+                           response_time_us=elapsed * 1000000)
+        elif resp.status == 200:
+            self.etag = resp.getheader('ETag')
+            self.cached_size = len(resp.data)
+            report_success(request_type='poll:200', name=self.name, response_time=int(elapsed * 1000), response_length=self.cached_size,
+                           response_time_us=elapsed * 1000000)
+
+
+class PollScheduler(object):
+    def __init__(self, tick=0.05, concurrency=200, interval=30, jitter=0.1):
+        self.interval = interval
+        self.jitter = jitter
+        self.wheel = TimingWheel(tick)
+        self.pools = PoolRegistry(mode=POOL_MODE_SHARED, maxsize=concurrency, keep_alive=registry.keep_alive)
+        self._workers = Pool(concurrency)
+        self._greenlet = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(tick=float(os.environ.get('LOCUST_POLL_TICK', 0.05)),
+                   concurrency=int(os.environ.get('LOCUST_POLL_CONCURRENCY', 200)),
+                   interval=float(os.environ.get('LOCUST_POLL_INTERVAL', 30)),
+                   jitter=float(os.environ.get('LOCUST_POLL_JITTER', 0.1)))
+
+    def _next_delay(self):
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def add(self, poller, first_delay=None):
+        if first_delay is None:
+            # spread the first polls over a whole interval so pollers don't move in lockstep
+            first_delay = random.uniform(0, self.interval)
+        self.wheel.schedule(poller, first_delay)
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._run)
+
+    def _poll(self, poller):
+        try:
+            poller.poll()
+        except Exception as e:
+            log.debug('poll of %s failed: %s', poller.url, e)
+        if not poller.cancelled:
+            self.wheel.schedule(poller, self._next_delay())
+
+    def _run(self):
+        while True:
+            gevent.sleep(self.wheel.tick)
+            for _ in range(self.wheel.due_ticks()):
+                for poller in self.wheel.advance():
+                    if not poller.cancelled:
+                        # blocks while every worker is busy, which delays the wheel instead of piling up polls
+                        self._workers.spawn(self._poll, poller)
+
+
+scheduler = PollScheduler.from_env()
+
+
+class PollingFirehoseTaskSet(TaskSet):
+    @task
+    def poll(self):
+        self.locust.run_pollers()
+
+
+class PollingFirehoseLocust(MonitoredLocust):
+    sdk_key = os.environ.get('LAUNCHDARKLY_SDK_KEY')
+    base_uri = os.environ.get('LAUNCHDARKLY_BASE_URI')
+    pollers_per_locust = int(os.environ.get('LOCUST_POLLERS_PER_LOCUST', 100))
+    task_set = PollingFirehoseTaskSet
+    wait_time = constant(1)
+
+    def __init__(self, *args, **kwargs):
+        super(PollingFirehoseLocust, self).__init__(*args, **kwargs)
+        if self.base_uri is None:
+            self.base_uri = self.host
+        # shared by all of the locust's pollers
+        self.headers = _headers(self.sdk_key)
+
+    def make_poller(self, http, index):
+        return Poller(http, self.base_uri.rstrip('/') + '/sdk/latest-all', self.headers)
+
+    def run_pollers(self):
+        """
+        Registers this locust's pollers with the scheduler and keeps them
+        polling until the locust is stopped.
+        """
+        http = scheduler.pools.get(self.base_uri)
+        pollers = [self.make_poller(http, i) for i in range(self.pollers_per_locust)]
+        for poller in pollers:
+            scheduler.add(poller)
+        try:
+            while True:
+                gevent.sleep(60)
+        finally:
+            for poller in pollers:
+                poller.cancelled = True
+
+
+class MobilePollingFirehoseLocust(PollingFirehoseLocust):
+    sdk_key = os.environ.get('LAUNCHDARKLY_MOBILE_KEY')
+    use_report = False
+
+    # override this method in your subclass to poll for different users
+    # with LOCUST_POPULATION_SIZE set, each poller is a user from the population
+    def generate_user(self, index):
+        population = get_population()
+        if population is not None:
+            return population.draw()
+        return {'key': 'poller-%d-%d' % (id(self), index)}
+
+    def make_poller(self, http, index):
+        user = self.generate_user(index)
+        encoded = user.encoded_for((), False) if isinstance(user, PopulationUser) else None
+        if encoded is not None:
+            user_json, user_b64 = encoded
+        else:
+            user_json = json.dumps(user).encode('utf-8')
+            user_b64 = urlsafe_b64encode(user_json).decode('utf-8')
+        if self.use_report:
+            return Poller(http, self.base_uri.rstrip('/') + '/msdk/evalx/user', self.headers, method='REPORT', body=user_json)
+        url = self.base_uri.rstrip('/') + '/msdk/evalx/users/' + user_b64
+        return Poller(http, url, self.headers)
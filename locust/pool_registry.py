@@ -0,0 +1,95 @@
+"""
+Process-wide registry of instrumented HTTP pool managers.
+
+Every SDK component used to build its own pool manager, so a worker held a
+few pool managers per virtual user. Components now ask the registry instead,
+which hands out pool managers keyed by (scheme, host, port, proxy, TLS
+settings). It has two modes, set with LOCUST_POOL_MODE:
+
+- ``dedicated`` (default): each caller, that is each SDK component of each
+  client, gets its own pool manager holding a single socket, like the real
+  SDK does.
+- ``shared``: every caller with the same key shares one pool manager holding
+  up to LOCUST_POOL_MAXSIZE idle sockets, so a worker holds one pool manager
+  per key however many virtual users it runs. The pool does not block, so
+  requests beyond that many in flight open sockets that are closed again
+  when they are returned; size it to the worker's concurrency.
+
+Socket counters are kept per key in either mode. LOCUST_POOL_KEEPALIVE=0
+closes sockets after every request instead of returning them to the pool.
+"""
+import os
+from collections import namedtuple
+
+from ldclient.util import _get_proxy_url
+from util import PoolStats, create_http_pool_manager
+
+try:
+  from urlparse import urlparse
+except ImportError:
+  from urllib.parse import urlparse
+
+POOL_MODE_DEDICATED = 'dedicated'
+POOL_MODE_SHARED = 'shared'
+
+PoolKey = namedtuple('PoolKey', ['scheme', 'host', 'port', 'proxy', 'verify_ssl'])
+
+
+class PoolRegistry(object):
+    def __init__(self, mode=POOL_MODE_DEDICATED, maxsize=10, keep_alive=True):
+        if mode not in (POOL_MODE_DEDICATED, POOL_MODE_SHARED):
+            raise ValueError('unknown pool mode: %s' % mode)
+        self.mode = mode
+        self.maxsize = maxsize
+        self.keep_alive = keep_alive
+        self._managers = {}
+        self._stats = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(mode=os.environ.get('LOCUST_POOL_MODE', POOL_MODE_DEDICATED),
+                   maxsize=int(os.environ.get('LOCUST_POOL_MAXSIZE', 10)),
+                   keep_alive=os.environ.get('LOCUST_POOL_KEEPALIVE', '1') != '0')
+
+    @staticmethod
+    def make_key(target_base_uri, verify_ssl=False, force_proxy=None):
+        x = urlparse(target_base_uri)
+        return PoolKey(scheme=x.scheme, host=x.hostname, port=x.port,
+                       proxy=force_proxy or _get_proxy_url(target_base_uri),
+                       verify_ssl=bool(verify_ssl))
+
+    def get(self, target_base_uri, verify_ssl=False, force_proxy=None):
+        key = self.make_key(target_base_uri, verify_ssl, force_proxy)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = PoolStats(self._stats_name(key))
+
+        if self.mode == POOL_MODE_DEDICATED:
+            return create_http_pool_manager(num_pools=1, verify_ssl=verify_ssl, target_base_uri=target_base_uri,
+                force_proxy=force_proxy, keep_alive=self.keep_alive, pool_stats=stats)
+
+        manager = self._managers.get(key)
+        if manager is None:
+            manager = self._managers[key] = create_http_pool_manager(num_pools=1, verify_ssl=verify_ssl,
+                target_base_uri=target_base_uri, force_proxy=force_proxy, maxsize=self.maxsize,
+                keep_alive=self.keep_alive, pool_stats=stats)
+        return manager
+
+    def stats(self):
+        return dict(self._stats)
+
+    @staticmethod
+    def _stats_name(key):
+        name = '%s://%s' % (key.scheme, key.host)
+        if key.port:
+            name += ':%d' % key.port
+        if key.proxy:
+            name += ' via %s' % key.proxy
+        return name
+
+
+registry = PoolRegistry.from_env()
+
+
+def get_pool_manager(target_base_uri, verify_ssl=False, force_proxy=None):
+    return registry.get(target_base_uri, verify_ssl=verify_ssl, force_proxy=force_proxy)
@@ -0,0 +1,298 @@
+"""
+Synthetic user population.
+
+By default every virtual user is the same anonymous user, which makes relay
+caching, mobile evaluation and event user deduplication far cheaper than
+they are in production. With LOCUST_POPULATION_SIZE set, users are drawn
+from a population of that many distinct users instead, Zipf-distributed so
+a few users come back often and most are rare, like real traffic:
+
+- LOCUST_POPULATION_SIZE: number of users, the population is off when unset
+- LOCUST_POPULATION_ZIPF: Zipf exponent of user and attribute popularity
+  (default 1.0, 0 draws uniformly)
+- LOCUST_POPULATION_ATTRIBUTES: comma separated name:cardinality pairs
+  (default groups:20,country:50,plan:4). Names LaunchDarkly knows, like
+  country or email, are set at the top level and the rest as custom
+  attributes
+- LOCUST_POPULATION_SOURCE: a file with one JSON user per line to load
+  instead of generating users, the first lines being the most popular
+- LOCUST_POPULATION_SEED: seed for generated users (default 0)
+- LOCUST_POPULATION_FILE: where to keep the built population, by default a
+  file in the temp directory named after the settings. The settings are
+  also kept in the file, which is rebuilt when they change
+
+Each user's JSON, its filtered JSON and base64 form, and the alias table
+used to draw users are written once to the population file, which every
+worker on the host maps into memory, so drawing a user is O(1) and shares
+pages between processes rather than building a copy per worker. Building
+and waiting for another worker to build take a native thread, so the hub
+keeps running, and start when hatching starts for the settings of every
+locust class.
+"""
+import binascii
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+import tempfile
+from array import array
+from base64 import urlsafe_b64encode
+
+import gevent
+from ldclient.user_filter import UserFilter
+from locust import events
+import locust.runners as runners
+
+from latency import clock
+from util import AliasTable
+
+log = logging.getLogger(__name__)
+
+size = int(os.environ.get('LOCUST_POPULATION_SIZE', 0))
+enabled = size > 0 or bool(os.environ.get('LOCUST_POPULATION_SOURCE'))
+
+MAGIC = b'LDPOP002'
+# magic, user count, and the sha1 of the settings the file was built with
+_header = struct.Struct('<8sQ20s')
+# per user: offset of its record, length of its JSON, length of its filtered JSON,
+# which is 0 when no attributes are private and the JSON is already filtered
+_entry = struct.Struct('<QII')
+
+
+def _b64_length(length):
+    return (length + 2) // 3 * 4
+
+
+def parse_attributes(spec):
+    attributes = []
+    for item in spec.split(','):
+        if item.strip():
+            name, cardinality = item.split(':')
+            attributes.append((name.strip(), int(cardinality)))
+    return attributes
+
+
+def zipf_weights(n, exponent):
+    return [1.0 / (rank ** exponent) for rank in range(1, n + 1)]
+
+
+class PopulationUser(dict):
+    """
+    A user from the population. It is a fresh dict, so clients can keep it
+    without a copy, and carries its encoded forms for MobileConfig.
+    """
+
+    def __init__(self, user, user_filter, filtered_json, b64):
+        super(PopulationUser, self).__init__(user)
+        self.user_filter = user_filter
+        self.filtered_json = filtered_json
+        self.b64 = b64
+
+    def encoded_for(self, private_attribute_names, all_attributes_private):
+        """The filtered JSON and base64 form, if they were built with the same private attributes."""
+        if self.user_filter == (tuple(sorted(private_attribute_names)), bool(all_attributes_private)):
+            return self.filtered_json, self.b64
+        return None
+
+
+class _FilterConfig(object):
+    def __init__(self, private_attribute_names, all_attributes_private):
+        self.private_attribute_names = private_attribute_names
+        self.all_attributes_private = all_attributes_private
+
+
+class Population(object):
+    def __init__(self, path, user_filter):
+        self.path = path
+        self.user_filter = user_filter
+        with open(path, 'rb') as population_file:
+            self._map = mmap.mmap(population_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, _ = _header.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a population file' % path)
+        view = memoryview(self._map)
+        offset = _header.size
+        prob = view[offset:offset + 8 * count].cast('d')
+        offset += 8 * count
+        alias = view[offset:offset + 8 * count].cast('l')
+        offset += 8 * count
+        self._entries = offset
+        self._alias = AliasTable.from_arrays(prob, alias)
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def draw(self, rng=random):
+        return self.user(self._alias.sample(rng))
+
+    def user(self, index):
+        offset, json_length, filtered_length = _entry.unpack_from(self._map, self._entries + index * _entry.size)
+        user_json = self._map[offset:offset + json_length]
+        if filtered_length:
+            filtered_json = self._map[offset + json_length:offset + json_length + filtered_length]
+        else:
+            filtered_json = user_json
+        b64_start = offset + json_length + filtered_length
+        b64 = self._map[b64_start:b64_start + _b64_length(len(filtered_json))].decode('ascii')
+        return PopulationUser(json.loads(user_json), self.user_filter, filtered_json, b64)
+
+
+def generate_users(count, exponent, attributes, seed):
+    rng = random.Random(seed)
+    tables = [(name, AliasTable(zipf_weights(cardinality, exponent))) for name, cardinality in attributes]
+    for i in range(count):
+        user = {'key': 'user-%d' % i}
+        custom = {}
+        for name, table in tables:
+            value = '%s-%d' % (name, table.sample(rng))
+            if name in UserFilter.ALLOWED_TOP_LEVEL_ATTRS:
+                user[name] = value
+            else:
+                custom[name] = value
+        if custom:
+            user['custom'] = custom
+        yield user
+
+
+def load_users(source):
+    with open(source) as source_file:
+        for line in source_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def build(path, users, exponent, user_filter, fingerprint=b''):
+    """Writes the population file for users, ranked by popularity in the order given."""
+    filter_config = UserFilter(_FilterConfig(*user_filter))
+    offsets = array('Q')
+    lengths = array('I')
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as data_file:
+        for user in users:
+            # the same encoding MobileConfig uses
+            user_json = json.dumps(user).encode('utf-8')
+            filtered_json = json.dumps(filter_config.filter_user_props(user)).encode('utf-8')
+            offsets.append(data_file.tell())
+            if filtered_json == user_json:
+                lengths.extend((len(user_json), 0))
+                data_file.write(user_json + urlsafe_b64encode(user_json))
+            else:
+                lengths.extend((len(user_json), len(filtered_json)))
+                data_file.write(user_json + filtered_json + urlsafe_b64encode(filtered_json))
+    count = len(offsets)
+    if count == 0:
+        os.remove(tmp_path)
+        raise ValueError('the population is empty')
+    prob, alias = AliasTable(zipf_weights(count, exponent)).arrays()
+    data_start = _header.size + 16 * count + _entry.size * count
+    entries = bytearray(_entry.size * count)
+    for i, offset in enumerate(offsets):
+        _entry.pack_into(entries, i * _entry.size, data_start + offset, lengths[2 * i], lengths[2 * i + 1])
+    with open(tmp_path, 'rb') as data_file, open(tmp_path + '.full', 'wb') as population_file:
+        population_file.write(_header.pack(MAGIC, count, fingerprint))
+        population_file.write(prob.tobytes())
+        population_file.write(alias.tobytes())
+        population_file.write(entries)
+        while True:
+            chunk = data_file.read(1 << 20)
+            if not chunk:
+                break
+            population_file.write(chunk)
+    os.remove(tmp_path)
+    os.replace(tmp_path + '.full', path)
+
+
+def _settings_from_env():
+    return {
+        'size': size,
+        'exponent': float(os.environ.get('LOCUST_POPULATION_ZIPF', 1.0)),
+        'attributes': parse_attributes(os.environ.get('LOCUST_POPULATION_ATTRIBUTES', 'groups:20,country:50,plan:4')),
+        'seed': int(os.environ.get('LOCUST_POPULATION_SEED', 0)),
+        'source': os.environ.get('LOCUST_POPULATION_SOURCE'),
+    }
+
+
+def _fingerprint(settings, user_filter):
+    fingerprint = dict(settings, filter=user_filter)
+    if settings['source']:
+        fingerprint['source_mtime'] = os.path.getmtime(settings['source'])
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).digest()
+
+
+def _built_with(path, fingerprint):
+    """Whether the file at path is a population built with these settings."""
+    try:
+        with open(path, 'rb') as population_file:
+            header = population_file.read(_header.size)
+    except (IOError, OSError):
+        return False
+    if len(header) < _header.size:
+        return False
+    magic, _, built_fingerprint = _header.unpack(header)
+    return magic == MAGIC and built_fingerprint == fingerprint
+
+
+def open_population(private_attribute_names=(), all_attributes_private=False, path=None):
+    """
+    Opens the population for these private attribute settings, building its
+    file first unless another worker already has. A file built with other
+    settings is rebuilt.
+    """
+    settings = _settings_from_env()
+    user_filter = (tuple(sorted(private_attribute_names)), bool(all_attributes_private))
+    fingerprint = _fingerprint(settings, user_filter)
+    path = path or os.environ.get('LOCUST_POPULATION_FILE') or os.path.join(
+        tempfile.gettempdir(), 'locust-population-%s.bin' % binascii.hexlify(fingerprint[:6]).decode('ascii'))
+    with open(path + '.lock', 'w') as lock_file:
+        # workers on the same host wait for the first one to build the file
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not _built_with(path, fingerprint):
+            if os.path.exists(path):
+                log.info('%s was built with other population settings, rebuilding it', path)
+            start = clock()
+            if settings['source']:
+                users = load_users(settings['source'])
+            else:
+                users = generate_users(settings['size'], settings['exponent'], settings['attributes'], settings['seed'])
+            build(path, users, settings['exponent'], user_filter, fingerprint)
+            log.info('built the user population in %s in %.1fs', path, clock() - start)
+    return Population(path, user_filter)
+
+
+# settings -> Population, or the AsyncResult of opening it
+_populations = {}
+
+
+def prepare(private_attribute_names=(), all_attributes_private=False):
+    """Starts opening the population for these settings in a native thread, if it is on."""
+    if not enabled:
+        return None
+    key = (tuple(sorted(private_attribute_names)), bool(all_attributes_private))
+    population = _populations.get(key)
+    if population is None:
+        population = _populations[key] = gevent.get_hub().threadpool.spawn(open_population, *key)
+    return population
+
+
+def get_population(private_attribute_names=(), all_attributes_private=False):
+    """The shared population for these private attribute settings, or None if it is off."""
+    population = prepare(private_attribute_names, all_attributes_private)
+    if population is None or isinstance(population, Population):
+        return population
+    key = (tuple(sorted(private_attribute_names)), bool(all_attributes_private))
+    population = _populations[key] = population.get()
+    return population
+
+
+def _on_start_hatching():
+    for locust_class in runners.locust_runner.locust_classes:
+        prepare(getattr(locust_class, 'private_attribute_names', ()), getattr(locust_class, 'all_attributes_private', False))
+
+
+if enabled:
+    events.locust_start_hatching += _on_start_hatching
@@ -0,0 +1,124 @@
+"""
+Flag propagation latency, corrected for clock skew between slaves and the
+master.
+
+The master writes its own clock into the locust-heartbeat flag and every
+client that receives the change reports how long ago that was. On a slave
+that difference includes the skew between the two clocks, which is often
+tens of milliseconds and can make the latency negative.
+
+Locust 0.13 can only send fixed hatch/stop/quit messages from the master to
+its slaves, so the offset is estimated on the master instead. Slaves don't
+report propagation samples themselves. They send them uncorrected, along
+with their clock at the time of sending, in every stats report. The master
+takes the smallest difference between its clock and the slave's send time
+over the last LOCUST_CLOCK_WINDOW reports (default 20) as that slave's
+offset. The estimate is off by at most the fastest one-way delay of a stats
+message, usually well under a millisecond. The master then records the
+corrected samples as sse:flag-update.
+
+In local mode, and on a master without slaves, the heartbeat is written by
+the same clock, so samples are recorded straight away. Every sample is also
+kept in a microsecond Histogram per stream, see histograms().
+"""
+import logging
+import os
+import time
+from collections import deque
+
+from locust import events
+import locust.runners as runners
+
+from histogram import Histogram
+from stats_aggregator import report_success
+import recorder
+
+log = logging.getLogger(__name__)
+
+clock_window = int(os.environ.get('LOCUST_CLOCK_WINDOW', 20))
+
+_histograms = {}
+_pending = {}
+_offset_samples = {}
+
+
+def _is_slave():
+    return isinstance(runners.locust_runner, runners.SlaveLocustRunner)
+
+
+def _record(name, latency_ms):
+    if latency_ms < 0:
+        log.debug('negative propagation latency of %.3fms for %s, clocks are still skewed', latency_ms, name)
+        latency_ms = 0
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms[name] = Histogram()
+    histogram.record(latency_ms * 1000)
+    report_success(request_type='sse:flag-update', name=name, response_time=int(latency_ms), response_length=0,
+                   response_time_us=latency_ms * 1000)
+
+
+def record_propagation(name, sent_ms, received_ms):
+    """
+    Records that a flag change written at sent_ms by the master's clock was
+    received at received_ms by this process's clock.
+    """
+    if recorder.enabled:
+        recorder.record('propagation', name=name, ms=received_ms - sent_ms)
+    if _is_slave():
+        _pending.setdefault(name, []).append(received_ms - sent_ms)
+    else:
+        _record(name, received_ms - sent_ms)
+
+
+def clock_offset(client_id):
+    """
+    The master's current estimate of how far ahead of the slave its clock
+    is, in milliseconds, or None before the slave has reported.
+    """
+    samples = _offset_samples.get(client_id)
+    return min(samples) if samples else None
+
+
+def clock_offsets():
+    return dict((client_id, clock_offset(client_id)) for client_id in _offset_samples)
+
+
+def histograms():
+    return _histograms
+
+
+def _on_report_to_master(client_id, data):
+    global _pending
+    data['propagation'] = {'clock': time.time() * 1000, 'samples': _pending}
+    _pending = {}
+
+
+def _on_slave_report(client_id, data):
+    propagation = data.get('propagation')
+    if propagation is None:
+        return
+    samples = _offset_samples.get(client_id)
+    if samples is None:
+        samples = _offset_samples[client_id] = deque(maxlen=clock_window)
+    first = not samples
+    samples.append(time.time() * 1000 - propagation['clock'])
+    offset = min(samples)
+    if first:
+        log.info('clock of slave %s is %.1fms behind the master (negative if ahead)', client_id, offset)
+    for name, deltas in propagation['samples'].items():
+        for delta in deltas:
+            _record(name, delta + offset)
+
+
+def _on_quitting():
+    for name, histogram in sorted(_histograms.items()):
+        if histogram.count:
+            log.info('propagation %s: %d samples, p50 %.3fms, p99 %.3fms, max %.3fms', name, histogram.count,
+                     histogram.value_at_percentile(50) / 1000.0, histogram.value_at_percentile(99) / 1000.0,
+                     histogram.max / 1000.0)
+
+
+events.report_to_master += _on_report_to_master
+events.slave_report += _on_slave_report
+events.quitting += _on_quitting
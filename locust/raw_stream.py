@@ -0,0 +1,179 @@
+"""
+Stream-only locusts that speak the streaming protocol directly, without an
+SDK client.
+
+Every LaunchDarklyLocust runs a whole SDK: an LDClient, an event processor
+thread, a feature store and a full decode of every payload, which limits a
+worker to a few thousand streams. RawStreamLocust and RawMobileStreamLocust
+open /all or /meval/<user> and only look for event boundaries, event names,
+heartbeat comments and locust-heartbeat patches, so one worker can hold many
+more idle connections. They report the same sse:connect, sse:heartbeat,
+sse:flag-update and sse:disconnect stats as the SDK locusts, and ld:init for
+the first put.
+
+A random decode_sample_rate share of the connections (LOCUST_RAW_DECODE_SAMPLE,
+default 0.01) fully decodes every payload, so decoding cost still shows up in
+the decode:* stats.
+"""
+import json
+import logging
+import os
+import random
+import re
+import time
+from base64 import urlsafe_b64encode
+
+from locust import TaskSet, task, constant
+from locust.events import request_failure
+from ldclient.util import _stream_headers
+
+from sse_client import SSEClient, event_name
+import storm
+from pool_registry import get_pool_manager
+from payload_cache import decode
+from propagation import record_propagation
+from population import get_population, PopulationUser
+from stats_aggregator import report_success
+from latency import clock
+from saturation import MonitoredLocust
+
+log = logging.getLogger(__name__)
+
+HEARTBEAT_FLAG = b'locust-heartbeat'
+
+_data_line = re.compile(br'^data: ?(.*)$', re.M)
+
+
+def event_data(raw):
+    """Returns the data of a raw event, with multiple data lines joined."""
+    return b'\n'.join(_data_line.findall(raw))
+
+
+class RawStreamClient(SSEClient):
+    """
+    Iterates over (event name, raw event) pairs without decoding them.
+    Heartbeat comments are reported and skipped.
+    """
+
+    def __next__(self):
+        while True:
+            raw = self._read_event()
+            if raw.startswith(b':'):
+                self._report_heartbeat()
+                end = raw.find(b'\n')
+                while end != -1 and raw[end + 1:end + 2] == b':':
+                    end = raw.find(b'\n', end + 1)
+                if end == -1:
+                    continue
+                raw = raw[end + 1:]
+            event = event_name(raw)
+            if storm.enabled and event == b'put':
+                storm.storm.on_put(self)
+            return event, raw
+
+
+class RawStreamTaskSet(TaskSet):
+    @task
+    def stream(self):
+        self.locust.run_stream()
+
+
+class RawStreamLocust(MonitoredLocust):
+    sdk_key = os.environ.get('LAUNCHDARKLY_SDK_KEY')
+    stream_uri = os.environ.get('LAUNCHDARKLY_STREAM_URI')
+    stream_path = '/all'
+    init_name = 'server'
+    decode_sample_rate = float(os.environ.get('LOCUST_RAW_DECODE_SAMPLE', 0.01))
+    read_timeout = 300
+    task_set = RawStreamTaskSet
+    # reconnect a second after the stream fails, like the SDK stream processors
+    wait_time = constant(1)
+
+    def __init__(self, *args, **kwargs):
+        super(RawStreamLocust, self).__init__(*args, **kwargs)
+        if self.stream_uri is None:
+            self.stream_uri = self.host
+        self._http = None
+
+    def stream_url(self):
+        return self.stream_uri.rstrip('/') + self.stream_path
+
+    def heartbeat_sent_time(self, payload):
+        if payload.get('path') != '/flags/locust-heartbeat':
+            return None
+        return payload['data'].get('variations', [None])[0]
+
+    def run_stream(self):
+        """
+        Reads the stream until it fails or the locust is stopped. Reconnects
+        after a disconnect are handled by the SSE client.
+        """
+        if self._http is None:
+            self._http = get_pool_manager(self.stream_uri)
+        decode_all = random.random() < self.decode_sample_rate
+        start_time = clock()
+        initialized = False
+        stream = None
+        try:
+            stream = RawStreamClient(self.stream_url(), headers=_stream_headers(self.sdk_key),
+                                     read_timeout=self.read_timeout, http=self._http, owner=self)
+            for event, raw in stream:
+                if event == b'put':
+                    if not initialized:
+                        initialized = True
+                        elapsed = clock() - start_time
+                        report_success(request_type='ld:init', name=self.init_name, response_time=int(elapsed * 1000), response_length=len(raw),
+                                       response_time_us=elapsed * 1000000)
+                    if decode_all:
+                        decode('put', event_data(raw))
+                elif event == b'patch':
+                    if HEARTBEAT_FLAG in raw:
+                        received = time.time() * 1000
+                        sent = self.heartbeat_sent_time(decode('patch', event_data(raw)))
+                        if sent is not None:
+                            record_propagation(self.stream_path, sent, received)
+                    elif decode_all:
+                        decode('patch', event_data(raw))
+                elif decode_all and event == b'delete':
+                    decode('delete', event_data(raw))
+        except Exception as e:
+            if not initialized:
+                request_failure.fire(request_type='ld:init', name=self.init_name, response_time=int((clock() - start_time) * 1000), response_length=0, exception=e)
+            log.warning('raw stream failed, reconnecting: %s', e)
+        finally:
+            # the socket is in the middle of a stream, so it can't be reused
+            if stream is not None:
+                stream.close()
+                stream.resp.close()
+                stream.resp.release_conn()
+
+
+class RawMobileStreamLocust(RawStreamLocust):
+    sdk_key = os.environ.get('LAUNCHDARKLY_MOBILE_KEY')
+    stream_uri = os.environ.get('LAUNCHDARKLY_MOBILE_STREAM_URI')
+    stream_path = '/meval'
+    init_name = 'mobile'
+    default_user = {"anonymous": True, "key": "anonymous"}
+
+    # override this method in your subclass
+    # if you want to generate random users for each Locust instance
+    # with LOCUST_POPULATION_SIZE set, each stream is for a user from the population
+    def generate_user(self):
+        population = get_population()
+        if population is not None:
+            return population.draw()
+        return self.default_user
+
+    def stream_url(self):
+        user = self.generate_user()
+        encoded = user.encoded_for((), False) if isinstance(user, PopulationUser) else None
+        if encoded is not None:
+            user_b64 = encoded[1]
+        else:
+            user_b64 = urlsafe_b64encode(json.dumps(user).encode('utf-8')).decode('utf-8')
+        return super(RawMobileStreamLocust, self).stream_url() + '/' + user_b64
+
+    def heartbeat_sent_time(self, payload):
+        if payload.get('key') != 'locust-heartbeat':
+            return None
+        return int(payload.get('value') or 0)
@@ -0,0 +1,134 @@
+"""
+Traffic recording.
+
+With LOCUST_RECORD_FILE set, every request made through the Locust pool
+managers, every SSE event, every flag propagation sample and every SDK call
+made on a client is appended to that file as one JSON line, so tails can be
+analysed offline after a full scale run. A {pid} in the path is replaced by
+the process id, to give each worker on a host its own file.
+
+Records are queued in memory and written by a native thread, so recording
+never blocks the gevent hub on disk I/O or JSON encoding. The queue holds at
+most LOCUST_RECORD_BUFFER records (default 100000); records that arrive
+while it is full are dropped rather than slowing the load down. Written and
+dropped records are reported every LOCUST_RECORD_INTERVAL seconds (default 1)
+as record:written and record:dropped, with the count as the response length.
+
+Every record has t, the wall clock time in seconds when it happened (when
+it started, for requests), and kind:
+
+- http: type, method, url, status, sent (request body bytes), bytes
+  (response bytes), us (duration), and error for failures
+- sse: url, event, bytes
+- propagation: name, ms
+- sdk: calls made on clients, op (open, variation, identify, track or
+  close) and session, one per client, with sdk (server or mobile) on open
+  and the user, flag, name and metric of the call. replay.py replays these
+"""
+import collections
+import json
+import logging
+import os
+import time
+
+import gevent
+from gevent import monkey
+from locust import events
+
+from stats_aggregator import report_success
+
+log = logging.getLogger(__name__)
+
+path = os.environ.get('LOCUST_RECORD_FILE')
+enabled = bool(path)
+buffer_size = int(os.environ.get('LOCUST_RECORD_BUFFER', 100000))
+interval = float(os.environ.get('LOCUST_RECORD_INTERVAL', 1))
+
+# the writer runs on a real thread even though locust monkey-patches threading
+_start_new_thread = monkey.get_original('_thread', 'start_new_thread')
+_allocate_lock = monkey.get_original('_thread', 'allocate_lock')
+_sleep = monkey.get_original('time', 'sleep')
+
+_queue = collections.deque()
+_counts = {'written': 0, 'dropped': 0}
+_reported = {'written': 0, 'dropped': 0}
+_running = False
+_stopped = False
+_done = _allocate_lock()
+_greenlet = None
+
+
+def record(kind, **fields):
+    """Queues a record, or drops it if the queue is full. Only call it when enabled is set."""
+    if len(_queue) >= buffer_size:
+        _counts['dropped'] += 1
+        return
+    fields.setdefault('t', time.time())
+    fields['kind'] = kind
+    _queue.append(fields)
+    if not _running and not _stopped:
+        start()
+
+
+def start():
+    global _running, _greenlet
+    if _running:
+        return
+    _running = True
+    _done.acquire()
+    _start_new_thread(_write_forever, (path.replace('{pid}', str(os.getpid())),))
+    if _greenlet is None and interval > 0:
+        _greenlet = gevent.spawn(_report_forever)
+
+
+def _drain(record_file):
+    lines = []
+    while _queue:
+        lines.append(json.dumps(_queue.popleft(), separators=(',', ':')))
+    if lines:
+        record_file.write('\n'.join(lines) + '\n')
+        record_file.flush()
+        _counts['written'] += len(lines)
+
+
+def _write_forever(record_path):
+    try:
+        with open(record_path, 'a') as record_file:
+            while _running:
+                _drain(record_file)
+                _sleep(0.1)
+            _drain(record_file)
+    except Exception as e:
+        log.error('recording to %s failed: %s', record_path, e)
+    finally:
+        _done.release()
+
+
+def report():
+    for name in ('written', 'dropped'):
+        count = _counts[name] - _reported[name]
+        if count:
+            _reported[name] += count
+            report_success(request_type='record:' + name, name='records', response_time=0, response_length=count)
+
+
+def _report_forever():
+    while True:
+        gevent.sleep(interval)
+        report()
+
+
+def _on_quitting():
+    global _running, _stopped
+    _stopped = True
+    if not _running:
+        return
+    _running = False
+    # the hub is shutting down anyway, so it can wait for the last records
+    if _done.acquire(True, 10):
+        _done.release()
+    log.info('recorded %d records to %s, dropped %d', _counts['written'], path, _counts['dropped'])
+
+
+if enabled:
+    events.quitting += _on_quitting
@@ -0,0 +1,257 @@
+"""
+Trace replay.
+
+ReplayLocust re-issues the SDK calls of a recording (see recorder.py) against
+the relay with their original timing, instead of the synthetic task weights
+of locustfile.py. Every client of the recorded run is a session: replay opens
+a client when the session did, which connects its stream, makes the same
+variation, identify and track calls, which also produce the event posts,
+and closes it again.
+
+The trace is read line by line as it is replayed, so it can be larger than
+memory. Each worker replays the sessions of its shard, picked by the user
+key of mobile sessions and by session for server ones, and hands each session
+to one of its replay locusts. Settings, per worker:
+
+- LOCUST_REPLAY_FILE: the recording to replay
+- LOCUST_REPLAY_SPEED: speed factor, 2 replays twice as fast (default 1)
+- LOCUST_REPLAY_SHARD: this worker's shard as index/count, for example 0/4
+  on the first of four slaves (default 0/1)
+- LOCUST_REPLAY_LOOP: set to 1 to start over at the end of the trace
+- LOCUST_REPLAY_CONCURRENCY: calls that can run at once (default 1000)
+
+Every call is reported as replay:lag, named after the call, with how far
+behind its scheduled time it started. When the lag grows, the generator
+rather than the relay has become the bottleneck.
+"""
+import hashlib
+import json
+import logging
+import os
+
+import gevent
+from gevent.lock import Semaphore
+from gevent.pool import Pool
+
+from locust import TaskSet, task, constant
+from locust.events import request_failure
+
+from launchdarkly_locust import LaunchDarklyLocust, LaunchDarklyMobileLocust
+from stats_aggregator import report_success
+from latency import clock
+from saturation import MonitoredLocust
+
+log = logging.getLogger(__name__)
+
+SDK_MOBILE = 'mobile'
+SDK_SERVER = 'server'
+
+
+def parse_shard(spec):
+    index, count = spec.split('/')
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError('invalid replay shard %r' % spec)
+    return index, count
+
+
+def _bucket(key, count):
+    return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) % count
+
+
+class TraceReader(object):
+    """The SDK records of a trace in this shard, read lazily."""
+
+    def __init__(self, path, shard=(0, 1)):
+        self.path = path
+        self.shard_index, self.shard_count = shard
+        # sessions of this shard that are open in the trace
+        self._sessions = set()
+
+    def _in_shard(self, record):
+        session = record.get('session')
+        if record.get('op') == 'open':
+            user = record.get('user') or {}
+            key = str(user['key']) if record.get('sdk') == SDK_MOBILE and 'key' in user else session
+            if _bucket(key, self.shard_count) != self.shard_index:
+                return False
+            self._sessions.add(session)
+            return True
+        if record.get('op') == 'close':
+            if session in self._sessions:
+                self._sessions.discard(session)
+                return True
+            return False
+        return session in self._sessions
+
+    def __iter__(self):
+        self._sessions.clear()
+        with open(self.path) as trace:
+            for line in trace:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get('kind') == 'sdk' and self._in_shard(record):
+                    yield record
+
+
+class Replayer(object):
+    def __init__(self, reader, speed=1.0, loop=False, concurrency=1000):
+        self.reader = reader
+        self.speed = speed
+        self.loop = loop
+        self._locusts = []
+        self._workers = Pool(concurrency)
+        # session -> [locust, lock], calls of a session run one at a time in order
+        self._sessions = {}
+        self._greenlet = None
+
+    def add(self, locust):
+        self._locusts.append(locust)
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._run)
+
+    def remove(self, locust):
+        self._locusts.remove(locust)
+        for session, (owner, _) in list(self._sessions.items()):
+            if owner is locust:
+                del self._sessions[session]
+
+    def _session(self, record):
+        session = record['session']
+        entry = self._sessions.get(session)
+        if entry is None and record['op'] == 'open':
+            locust = self._locusts[_bucket(session, len(self._locusts))]
+            entry = self._sessions[session] = [locust, Semaphore()]
+        elif record['op'] == 'close':
+            self._sessions.pop(session, None)
+        return entry
+
+    def _execute(self, locust, lock, record, intended):
+        op = record['op']
+        with lock:
+            lag = clock() - intended
+            report_success(request_type='replay:lag', name=op, response_time=int(lag * 1000), response_length=0,
+                           response_time_us=lag * 1000000)
+            try:
+                locust.replay(record)
+            except Exception as e:
+                request_failure.fire(request_type='replay', name=op, response_time=0, response_length=0, exception=e)
+
+    def _replay_once(self):
+        start = None
+        trace_start = None
+        for record in self.reader:
+            if not self._locusts:
+                return False
+            if start is None:
+                start, trace_start = clock(), record['t']
+            intended = start + (record['t'] - trace_start) / self.speed
+            delay = intended - clock()
+            if delay > 0:
+                gevent.sleep(delay)
+            entry = self._session(record)
+            if entry is not None and entry[0] in self._locusts:
+                # blocks while every worker is busy, which counts towards the lag
+                self._workers.spawn(self._execute, entry[0], entry[1], record, intended)
+        return True
+
+    def _run(self):
+        try:
+            while self._replay_once() and self.loop:
+                log.info('replayed %s, starting over', self.reader.path)
+                self._close_sessions()
+            if self._locusts:
+                log.info('replayed %s', self.reader.path)
+        finally:
+            self._greenlet = None
+
+    def _close_sessions(self):
+        sessions, self._sessions = self._sessions, {}
+        for session, (locust, lock) in sessions.items():
+            self._workers.spawn(self._execute, locust, lock, {'op': 'close', 'session': session}, clock())
+
+
+_replayer = None
+
+
+def get_replayer():
+    global _replayer
+    if _replayer is None:
+        reader = TraceReader(os.environ['LOCUST_REPLAY_FILE'], parse_shard(os.environ.get('LOCUST_REPLAY_SHARD', '0/1')))
+        _replayer = Replayer(reader, speed=float(os.environ.get('LOCUST_REPLAY_SPEED', 1)),
+                             loop=os.environ.get('LOCUST_REPLAY_LOOP') == '1',
+                             concurrency=int(os.environ.get('LOCUST_REPLAY_CONCURRENCY', 1000)))
+    return _replayer
+
+
+class ReplayTaskSet(TaskSet):
+    wait_time = constant(0)
+
+    @task
+    def replay(self):
+        self.locust.run_replay()
+
+
+class ReplayLocust(MonitoredLocust):
+    """
+    Replays its share of the sessions of LOCUST_REPLAY_FILE. Clients are made
+    by server_locust_class and mobile_locust_class, so they use the same
+    settings as the regular locusts.
+    """
+    server_locust_class = LaunchDarklyLocust
+    mobile_locust_class = LaunchDarklyMobileLocust
+    task_set = ReplayTaskSet
+
+    def __init__(self, *args, **kwargs):
+        super(ReplayLocust, self).__init__(*args, **kwargs)
+        self._factories = {SDK_SERVER: self.server_locust_class(), SDK_MOBILE: self.mobile_locust_class()}
+        for factory in self._factories.values():
+            for attr in ('base_uri', 'events_uri', 'stream_uri'):
+                if getattr(factory, attr) is None:
+                    setattr(factory, attr, self.host)
+        # session -> (sdk, client)
+        self._clients = {}
+
+    def replay(self, record):
+        op = record['op']
+        session = record['session']
+        if op == 'open':
+            sdk = record.get('sdk', SDK_SERVER)
+            if sdk == SDK_MOBILE:
+                client = self._factories[sdk].make_client(record['user'])
+            else:
+                client = self._factories[sdk].make_client()
+            self._clients[session] = (sdk, client)
+            return
+        entry = self._clients.get(session)
+        if entry is None:
+            return
+        sdk, client = entry
+        if op == 'close':
+            del self._clients[session]
+            client.close()
+        elif op == 'variation':
+            if sdk == SDK_MOBILE:
+                client.variation(record['flag'], None)
+            else:
+                client.variation(record['flag'], record['user'], None)
+        elif op == 'identify':
+            client.identify(record['user'])
+        elif op == 'track':
+            if sdk == SDK_MOBILE:
+                client.track(record['name'], metric_value=record.get('metric'))
+            else:
+                client.track(record['name'], record['user'], metric_value=record.get('metric'))
+
+    def run_replay(self):
+        replayer = get_replayer()
+        replayer.add(self)
+        try:
+            while True:
+                gevent.sleep(60)
+        finally:
+            replayer.remove(self)
+            for sdk, client in self._clients.values():
+                client.close()
+            self._clients.clear()
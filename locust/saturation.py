@@ -0,0 +1,223 @@
+"""
+Load generator saturation.
+
+When a worker runs out of CPU, or its gevent hub is starved, the response
+times it reports are its own scheduling delay rather than the relay's. Every
+LOCUST_SATURATION_INTERVAL seconds (default 1, 0 disables it) a monitor
+greenlet samples the worker and reports:
+
+- worker:cpu, the process CPU use in percent as the response time
+- worker:rss, resident memory in bytes as the response length
+- worker:fds, open file descriptors as the response length
+
+Hub loop lag is already reported by the hub probe as hub:blocked. Slaves also
+send their latest sample to the master, which logs when a slave becomes
+saturated and lists the slaves that were when it quits.
+
+A worker is saturated while any of these thresholds is exceeded:
+
+- LOCUST_SATURATION_HUB_LAG: hub lag in milliseconds (default 50)
+- LOCUST_SATURATION_CPU: CPU percent (default 90)
+- LOCUST_SATURATION_RSS_MB: resident memory in MB (default 0, no limit)
+- LOCUST_SATURATION_FDS: open file descriptors (default 90% of the soft limit)
+
+LOCUST_SATURATION_ACTION is a comma separated list of what to do about it,
+besides logging (default none):
+
+- throttle: locusts hatched while the worker is saturated wait before they
+  start, and report how long they waited as worker:throttled
+- invalidate: report each saturated sample as a worker:saturated failure,
+  named after the threshold, which also makes Locust exit with an error
+"""
+import logging
+import os
+
+import gevent
+from locust import Locust, events
+from locust.events import request_failure
+import locust.runners as runners
+
+from stats_aggregator import report_success
+from latency import clock
+import hub_monitor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+log = logging.getLogger(__name__)
+
+ACTION_THROTTLE = 'throttle'
+ACTION_INVALIDATE = 'invalidate'
+
+
+class Saturated(Exception):
+    pass
+
+
+def _default_fd_limit():
+    if resource is None:
+        return 0
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    return int(soft * 0.9) if soft != resource.RLIM_INFINITY else 0
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        if resource is None:
+            return None
+        # peak rather than current, but still catches a worker that runs away
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+class SaturationMonitor(object):
+    def __init__(self, interval=1.0, hub_lag_ms=50, cpu_percent=90, rss_mb=0, fds=0, actions=()):
+        self.interval = interval
+        self.thresholds = {'hub_lag_ms': hub_lag_ms, 'cpu': cpu_percent, 'rss_mb': rss_mb, 'fds': fds}
+        self.actions = frozenset(actions)
+        self.sample = {}
+        self.saturated = []
+        self._greenlet = None
+        self._cpu_at = None
+
+    @classmethod
+    def from_env(cls):
+        actions = [a.strip() for a in os.environ.get('LOCUST_SATURATION_ACTION', '').split(',') if a.strip()]
+        for action in actions:
+            if action not in (ACTION_THROTTLE, ACTION_INVALIDATE):
+                raise ValueError('unknown LOCUST_SATURATION_ACTION %r' % action)
+        return cls(interval=float(os.environ.get('LOCUST_SATURATION_INTERVAL', 1)),
+                   hub_lag_ms=float(os.environ.get('LOCUST_SATURATION_HUB_LAG', 50)),
+                   cpu_percent=float(os.environ.get('LOCUST_SATURATION_CPU', 90)),
+                   rss_mb=float(os.environ.get('LOCUST_SATURATION_RSS_MB', 0)),
+                   fds=int(os.environ.get('LOCUST_SATURATION_FDS', 0) or _default_fd_limit()),
+                   actions=actions)
+
+    def start(self):
+        if self._greenlet is None and self.interval > 0:
+            self._greenlet = gevent.spawn(self._run)
+
+    def _cpu_percent(self):
+        times = os.times()
+        now = (clock(), times.user + times.system)
+        previous, self._cpu_at = self._cpu_at, now
+        if previous is None or now[0] <= previous[0]:
+            return None
+        return (now[1] - previous[1]) / (now[0] - previous[0]) * 100
+
+    def check(self, sample):
+        """The thresholds the sample exceeds, as (name, message) pairs."""
+        exceeded = []
+        for name, limit in sorted(self.thresholds.items()):
+            value = sample.get(name)
+            if limit and value is not None and value > limit:
+                exceeded.append((name, '%s %.1f over %.1f' % (name, value, limit)))
+        return exceeded
+
+    def take_sample(self, own_lag):
+        rss = rss_bytes()
+        sample = {
+            # the hub probe wakes up more often, so it sees shorter stalls
+            'hub_lag_ms': max(hub_monitor.hub_probe.take_window_max(), own_lag) * 1000,
+            'cpu': self._cpu_percent(),
+            'rss_mb': rss / 1048576.0 if rss is not None else None,
+            'fds': open_fds(),
+        }
+        if sample['cpu'] is not None:
+            report_success(request_type='worker:cpu', name='percent', response_time=int(sample['cpu']), response_length=0)
+        if rss is not None:
+            report_success(request_type='worker:rss', name='bytes', response_time=0, response_length=rss)
+        if sample['fds'] is not None:
+            report_success(request_type='worker:fds', name='open', response_time=0, response_length=sample['fds'])
+        return sample
+
+    def _run(self):
+        self._cpu_percent()
+        while True:
+            start = clock()
+            gevent.sleep(self.interval)
+            own_lag = max(clock() - start - self.interval, 0.0)
+            sample = self.take_sample(own_lag)
+            exceeded = self.check(sample)
+            if exceeded and not self.saturated:
+                log.warning('load generator saturated: %s', ', '.join(message for _, message in exceeded))
+            elif self.saturated and not exceeded:
+                log.info('load generator no longer saturated')
+            if ACTION_INVALIDATE in self.actions:
+                for name, message in exceeded:
+                    request_failure.fire(request_type='worker:saturated', name=name, response_time=0, response_length=0,
+                                         exception=Saturated(message))
+            sample['saturated'] = [name for name, _ in exceeded]
+            self.sample = sample
+            self.saturated = sample['saturated']
+
+    def wait_until_clear(self):
+        """Holds a locust back while the worker is saturated, if throttling is on."""
+        if ACTION_THROTTLE not in self.actions or not self.saturated:
+            return
+        start = clock()
+        while self.saturated:
+            gevent.sleep(self.interval)
+        waited = clock() - start
+        report_success(request_type='worker:throttled', name='hatch', response_time=int(waited * 1000), response_length=0,
+                       response_time_us=waited * 1000000)
+
+
+monitor = SaturationMonitor.from_env()
+
+# slave id -> number of reports it was saturated in, on the master
+_saturated_reports = {}
+
+
+def _on_report_to_master(client_id, data):
+    if monitor.sample:
+        data['saturation'] = monitor.sample
+
+
+def _on_slave_report(client_id, data):
+    sample = data.get('saturation')
+    if not sample:
+        return
+    if sample.get('saturated'):
+        if not _saturated_reports.get(client_id):
+            log.warning('slave %s is saturated: %s', client_id, ', '.join(sample['saturated']))
+        _saturated_reports[client_id] = _saturated_reports.get(client_id, 0) + 1
+
+
+def _on_quitting():
+    if _saturated_reports and not isinstance(runners.locust_runner, runners.SlaveLocustRunner):
+        log.warning('slaves were saturated, their response times include load generator delay: %s',
+                    ', '.join('%s (%d reports)' % item for item in sorted(_saturated_reports.items())))
+
+
+events.report_to_master += _on_report_to_master
+events.slave_report += _on_slave_report
+events.quitting += _on_quitting
+
+
+class MonitoredLocust(Locust):
+    """
+    A Locust that starts the hub probe and the saturation monitor, and waits
+    to start while the worker is saturated if throttling is on.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(MonitoredLocust, self).__init__(*args, **kwargs)
+        # only slaves create locusts, so the master never runs the monitors
+        hub_monitor.start()
+        monitor.start()
+
+    def run(self, *args, **kwargs):
+        monitor.wait_until_clear()
+        return super(MonitoredLocust, self).run(*args, **kwargs)
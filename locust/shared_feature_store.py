@@ -0,0 +1,79 @@
+"""
+Feature store that shares identical flag and segment objects between every
+client in the worker process.
+
+Each client normally keeps its own decoded copy of the same flag data, so
+worker memory grows linearly with virtual users. SharedFeatureStore interns
+every item it stores in a process-wide table and keeps the first copy it saw,
+so clients end up pointing at the same objects. Items are looked up by
+(kind, key, version), which identifies server-side flags and segments, or by
+a hash of their content for mobile payloads, where the same flag version
+evaluates differently per user.
+
+Shared items are read-only. Anything that needs to change one must copy it
+first, which the SDK already does.
+"""
+import hashlib
+import json
+import sys
+import weakref
+
+from ldclient.feature_store import InMemoryFeatureStore
+
+from client_evaluate import RESULT_KEY
+
+INTERN_BY_VERSION = 'version'
+INTERN_BY_CONTENT = 'content'
+
+
+class SharedItem(dict):
+    __slots__ = ('__weakref__',)
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('shared feature store items are read-only, copy the item before changing it')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+
+# items stay in the table for as long as any store holds them
+_shared_items = weakref.WeakValueDictionary()
+
+
+def _version_key(kind, item):
+    return (kind.namespace, item.get('key'), item.get('version'))
+
+
+def _content_key(kind, item):
+    # the precomputed evaluation result is derived from the rest of the flag
+    content = json.dumps(dict((k, v) for k, v in item.items() if k != RESULT_KEY),
+                         sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return (kind.namespace, item.get('key'), hashlib.sha1(content).digest())
+
+
+class SharedFeatureStore(InMemoryFeatureStore):
+    def __init__(self, intern_by=INTERN_BY_VERSION):
+        super(SharedFeatureStore, self).__init__()
+        self._make_key = _content_key if intern_by == INTERN_BY_CONTENT else _version_key
+
+    def _intern(self, kind, item):
+        if isinstance(item, SharedItem) or item.get('deleted'):
+            return item
+        key = self._make_key(kind, item)
+        shared = _shared_items.get(key)
+        if shared is None:
+            shared = SharedItem(item)
+            _shared_items[key] = shared
+        return shared
+
+    def init(self, all_data):
+        interned = {}
+        for kind, items in all_data.items():
+            interned[kind] = dict((sys.intern(key), self._intern(kind, item)) for key, item in items.items())
+        super(SharedFeatureStore, self).init(interned)
+
+    def upsert(self, kind, item):
+        super(SharedFeatureStore, self).upsert(kind, self._intern(kind, item))
+
+
+def shared_item_count():
+    return len(_shared_items)
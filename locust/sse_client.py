@@ -6,26 +6,50 @@ Based on: https://bitbucket.org/btubbs/sseclient/src/a47a380a3d7182a205c0f1d5eb4
 # currently excluded from documentation - see docs/README.md
 
 import re
+import socket
 import time
 
 import six
 
 import urllib3
 
-from util import create_http_pool_manager, clean_name
+from util import clean_name
+from pool_registry import get_pool_manager
 from ldclient.util import log
 from ldclient.util import throw_if_unsuccessful_response
-from locust.events import request_success, request_failure
-import time
+from locust.events import request_failure
+from stats_aggregator import report_success
+from latency import clock
+import storm
+import wire
+import recorder
 # Technically, we should support streams that mix line endings.  This regex,
 # however, assumes that a system will provide consistent line endings.
-end_of_field = re.compile(r'\r\n\r\n|\r\r|\n\n')
+end_of_field = re.compile(br'\r\n\r\n|\r\r|\n\n')
+
+# the longest separator is 4 bytes, so a separator split across two chunks
+# always starts within the last 3 bytes of the buffer
+_max_partial_separator = 3
+
+_event_line = re.compile(br'^event: ?(.*)$', re.M)
+
+
+def event_name(raw):
+    """The type of a raw event, or comment if it is only comments."""
+    match = _event_line.search(raw)
+    if match is not None:
+        return bytes(match.group(1).rstrip(b'\r'))
+    if raw.startswith(b':') and b'data' not in raw:
+        return b'comment'
+    return b'message'
 
 
 class SSEClient(object):
     def __init__(self, url, last_id=None, retry=3000, connect_timeout=10, read_timeout=300, chunk_size=10000,
-                 verify_ssl=False, http=None, http_proxy=None, **kwargs):
+                 verify_ssl=False, http=None, http_proxy=None, owner=None, **kwargs):
         self.url = url
+        # reconnect storms track streams by owner, which outlives a stream that fails
+        self.owner = owner
         self.last_id = last_id
         self.retry = retry
         self._connect_timeout = connect_timeout
@@ -33,8 +57,7 @@ class SSEClient(object):
         self._chunk_size = chunk_size
 
         # Optional support for passing in an HTTP client
-        self.http = create_http_pool_manager(num_pools=1, verify_ssl=verify_ssl, target_base_uri=url,
-            force_proxy=http_proxy)
+        self.http = http or get_pool_manager(url, verify_ssl=verify_ssl, force_proxy=http_proxy)
 
         # Any extra kwargs will be fed into the request call later.
         self.requests_kwargs = kwargs
@@ -47,14 +70,25 @@ class SSEClient(object):
         # The 'Accept' header is not required, but explicit > implicit
         self.requests_kwargs['headers']['Accept'] = 'text/event-stream'
 
-        # Keep data here as it streams in
-        self.buf = u''
-
+        # Keep undecoded data here as it streams in. Only the bytes after
+        # _scan_pos have not been searched for an event boundary yet.
+        self.buf = bytearray()
+        self._scan_pos = 0
+        self._closed = False
+        self._dropped = False
+        self.bytes_received = 0
+        self._stream_bytes = 0
+        self._stream_reported = False
+
+        wire.start()
         self._connect()
 
     def _connect(self):
         self._last_heartbeat = None
-        self._connect_start = time.time()
+        self._dropped = False
+        self._stream_bytes = 0
+        self._stream_reported = False
+        self._connect_start = clock()
         if self.last_id:
             self.requests_kwargs['headers']['Last-Event-ID'] = self.last_id
 
@@ -74,38 +108,103 @@ class SSEClient(object):
         # TODO: Ensure we're handling redirects.  Might also stick the 'origin'
         # attribute on Events like the Javascript spec requires.
         throw_if_unsuccessful_response(self.resp)
+        if storm.enabled:
+            storm.storm.on_connected(self)
 
-    def _event_complete(self):
-        return re.search(end_of_field, self.buf[len(self.buf)-self._chunk_size-10:]) is not None  # Just search the last chunk plus a bit
-
-    def __iter__(self):
-        return self
+    def _read_event(self):
+        """
+        Returns the raw bytes of the next complete event, reading more of the
+        stream as needed. Each byte of the stream is only scanned for a
+        boundary once, however large the event is.
+        """
+        while True:
+            match = end_of_field.search(self.buf, self._scan_pos)
+            if match is not None:
+                raw = self.buf[:match.start()]
+                name = event_name(raw)
+                wire.count(name, match.end())
+                if recorder.enabled:
+                    recorder.record('sse', url=self.url, event=name.decode('utf-8', 'replace'), bytes=match.end())
+                del self.buf[:match.end()]
+                self._scan_pos = 0
+                return raw
+            self._scan_pos = max(len(self.buf) - _max_partial_separator, 0)
 
-    def __next__(self):
-        while not self._event_complete():
             try:
                 nextline = next(self.resp_file)
                 # There are some bad cases where we don't always get a line: https://github.com/requests/requests/pull/2431
                 if not nextline:
                     raise EOFError()
-                self.buf += nextline.decode("utf-8")
-            except (StopIteration, EOFError) as e:
-                request_failure.fire(request_type='sse:disconnect', name="/meval", response_time=int((time.time() - self._connect_start) * 1000), response_length=0, exception=e)
+                self.buf += nextline
+                wire.count(wire.ALL, len(nextline))
+                self.bytes_received += len(nextline)
+                self._stream_bytes += len(nextline)
+            except Exception as e:
+                # reading fails in all sorts of ways once close() pulls the socket away
+                if self._closed:
+                    self.resp.close()
+                    self.resp.release_conn()
+                    raise StopIteration()
+                if not isinstance(e, (StopIteration, EOFError)) and not self._dropped:
+                    raise
+                self._report_stream()
+                request_failure.fire(request_type='sse:disconnect', name=clean_name('GET', self.url), response_time=int((clock() - self._connect_start) * 1000), response_length=0, exception=e)
                 time.sleep(self.retry / 1000.0)
-                
+                self._connect()
 
                 # The SSE spec only supports resuming from a whole message, so
                 # if we have half a message we should throw it out.
-                head, sep, tail = self.buf.rpartition('\n')
-                self.buf = head + sep
-                continue
+                del self.buf[:]
+                self._scan_pos = 0
+
+    def _report_stream(self):
+        if self._stream_reported:
+            return
+        self._stream_reported = True
+        lifetime = clock() - self._connect_start
+        report_success(request_type='wire:stream', name=clean_name('GET', self.url), response_time=int(lifetime * 1000),
+                       response_length=self._stream_bytes)
+
+    def _report_heartbeat(self):
+        now = clock()
+        last_heartbeat = self._last_heartbeat or self._connect_start
+        duration = now - last_heartbeat
+        report_success(request_type='sse:heartbeat', name=clean_name('GET', self.url), response_time=int(duration * 1000), response_length=0,
+                       response_time_us=duration * 1000000)
+        self._last_heartbeat = now
+
+    def close(self):
+        """
+        Ends iteration, including a read that is currently blocked in another
+        greenlet. The socket is shut down rather than closed so that the
+        blocked read sees EOF, and the reader releases the response.
+        """
+        self._closed = True
+        if storm.enabled:
+            storm.storm.on_closed(self)
+        self._report_stream()
+        self.drop()
 
-        split = re.split(end_of_field, self.buf)
-        head = split[0]
-        tail = "".join(split[1:])
+    def drop(self):
+        """
+        Pulls the socket away like a relay going down would, without ending
+        iteration, so the client reports a disconnect and reconnects.
+        """
+        self._dropped = True
+        sock = getattr(self.resp.connection, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
 
-        self.buf = tail
-        msg = Event.parse(head, instance=self)
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        msg = Event.parse(self._read_event().decode('utf-8'), instance=self)
+        if storm.enabled and msg.event == 'put':
+            storm.storm.on_put(self)
 
         # If the server requests a specific retry delay, we need to honor it.
         if msg.retry:
@@ -170,11 +269,7 @@ class Event(object):
             value = m.groupdict()['value']
             if name == '':
                 if instance is not None:
-                    now = time.time()
-                    last_heartbeat = instance._last_heartbeat or instance._connect_start
-                    duration = int((now - last_heartbeat) * 1000)
-                    request_success.fire(request_type='sse:heartbeat', name=clean_name('GET', instance.url), response_time=duration, response_length=0)
-                    instance._last_heartbeat = now
+                    instance._report_heartbeat()
                 # line began with a ":", so is a comment.  Ignore
                 continue
 
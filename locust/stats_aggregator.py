@@ -0,0 +1,177 @@
+"""
+Batched recording of successful requests.
+
+Firing request_success for every request and every SSE heartbeat dispatches
+through locust's event hooks and updates its stats dicts each time, which
+dominates profiles at tens of thousands of streams. With LOCUST_BATCH_STATS=1,
+report_success() instead records into a small preallocated histogram per
+(request_type, name) and the totals are merged into locust's stats every
+LOCUST_STATS_FLUSH_INTERVAL seconds (default 1), and right before a slave
+reports to the master. Response times are bucketed exactly like locust rounds
+them, so the reported numbers are the same.
+
+Failures are rare and carry exception details, so they are always fired
+straight to locust.
+
+Callers that time with latency.clock() also pass the exact duration as
+response_time_us, which goes to the microsecond histograms in latency.py.
+"""
+import os
+import time
+from array import array
+
+import gevent
+
+from locust import events
+from locust.events import request_success
+from locust.stats import global_stats, StatsEntry
+
+import latency
+
+enabled = os.environ.get('LOCUST_BATCH_STATS', '0') == '1'
+flush_interval = float(os.environ.get('LOCUST_STATS_FLUSH_INTERVAL', 1))
+
+
+def _bucket_index(response_time):
+    # same rounding as locust's StatsEntry._log_response_time, mapped onto
+    # consecutive slots: 0-99 in 1ms steps, then 10ms steps, then 100ms steps.
+    # Negative times, like propagation under clock skew, have no slot
+    if response_time < 0:
+        return None
+    if response_time < 100:
+        return int(response_time)
+    elif response_time < 1000:
+        return 100 + (int(round(response_time, -1)) - 100) // 10
+    elif response_time < 10000:
+        rounded = int(round(response_time, -2))
+        if rounded < 10000:
+            return 190 + (rounded - 1000) // 100
+    return None
+
+_bucket_values = list(range(100)) + list(range(100, 1000, 10)) + list(range(1000, 10000, 100))
+_num_buckets = len(_bucket_values)
+
+
+class _Aggregate(object):
+    __slots__ = ('count', 'none_count', 'total_response_time', 'min_response_time', 'max_response_time',
+                 'total_content_length', 'buckets', 'overflow', 'per_sec', 'first_timestamp', 'last_timestamp')
+
+    def __init__(self):
+        self.buckets = array('l', bytes(array('l').itemsize * _num_buckets))
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.none_count = 0
+        self.total_response_time = 0
+        self.min_response_time = None
+        self.max_response_time = 0
+        self.total_content_length = 0
+        self.overflow = {}
+        self.per_sec = {}
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def record(self, response_time, response_length):
+        now = time.time()
+        second = int(now)
+        self.per_sec[second] = self.per_sec.get(second, 0) + 1
+        if self.first_timestamp is None:
+            self.first_timestamp = now
+        self.last_timestamp = now
+        self.count += 1
+        self.total_content_length += response_length
+
+        if response_time is None:
+            self.none_count += 1
+            return
+        self.total_response_time += response_time
+        if self.min_response_time is None or response_time < self.min_response_time:
+            self.min_response_time = response_time
+        if response_time > self.max_response_time:
+            self.max_response_time = response_time
+
+        index = _bucket_index(response_time)
+        if index is not None:
+            self.buckets[index] += 1
+        else:
+            # locust keeps times under 100ms, negative ones included, as they are
+            rounded = response_time if response_time < 100 else int(round(response_time, -3))
+            self.overflow[rounded] = self.overflow.get(rounded, 0) + 1
+
+    def to_stats_entry(self, request_type, name):
+        entry = StatsEntry(global_stats, name, request_type)
+        entry.start_time = self.first_timestamp
+        entry.last_request_timestamp = self.last_timestamp
+        entry.num_requests = self.count
+        entry.num_none_requests = self.none_count
+        entry.total_response_time = self.total_response_time
+        entry.min_response_time = self.min_response_time
+        entry.max_response_time = self.max_response_time
+        entry.total_content_length = self.total_content_length
+        entry.num_reqs_per_sec = self.per_sec
+        response_times = dict(self.overflow)
+        buckets = self.buckets
+        for i in range(_num_buckets):
+            if buckets[i]:
+                response_times[_bucket_values[i]] = buckets[i]
+                buckets[i] = 0
+        entry.response_times = response_times
+        return entry
+
+
+_aggregates = {}
+
+
+def report_success(request_type, name, response_time, response_length, response_time_us=None):
+    """
+    Drop-in replacement for request_success.fire that batches when enabled.
+    """
+    if latency.enabled:
+        latency.record(request_type, name, response_time * 1000 if response_time_us is None else response_time_us)
+    if not enabled:
+        request_success.fire(request_type=request_type, name=name, response_time=response_time, response_length=response_length)
+        return
+    aggregate = _aggregates.get((request_type, name))
+    if aggregate is None:
+        aggregate = _aggregates[(request_type, name)] = _Aggregate()
+    aggregate.record(response_time, response_length)
+
+
+def _extend(target, entry):
+    # locust snapshots response times whenever a new second starts so that it
+    # can show current percentiles, do the same before merging the batch
+    if target.use_response_times_cache and target.last_request_timestamp \
+            and int(entry.last_request_timestamp) > int(target.last_request_timestamp):
+        target._cache_response_times(int(entry.last_request_timestamp) - 1)
+    target.extend(entry)
+
+
+def flush():
+    for (request_type, name), aggregate in list(_aggregates.items()):
+        if aggregate.count == 0:
+            continue
+        entry = aggregate.to_stats_entry(request_type, name)
+        aggregate.reset()
+        _extend(global_stats.get(name, request_type), entry)
+        _extend(global_stats.total, entry)
+
+
+def _flush_forever():
+    while True:
+        gevent.sleep(flush_interval)
+        flush()
+
+
+def _on_report_to_master(client_id, data):
+    flush()
+
+
+if enabled:
+    gevent.spawn(_flush_forever)
+    # locust's own report_to_master handler, registered when locust.stats was
+    # imported, serializes global_stats into the report. The batch has to be
+    # merged before that or it would reach the master one report late, and
+    # EventHook has no public way to add a handler in front of another
+    events.report_to_master._handlers.insert(0, _on_report_to_master)
+    events.quitting += flush
@@ -0,0 +1,163 @@
+"""
+Reconnect storms.
+
+When a relay restarts, every stream it served reconnects within seconds. With
+LOCUST_STORM=1 a worker can reproduce that: a storm drops the sockets of
+LOCUST_STORM_PERCENT of its open streams (default 100), either all at once or
+in LOCUST_STORM_WAVES waves (default 1) spread LOCUST_STORM_WAVE_INTERVAL
+seconds apart (default 5). Each stream sees the drop like a relay going away:
+it reports sse:disconnect and goes through its usual reconnect logic.
+
+Storms are triggered by sending SIGUSR2 to a worker, or every LOCUST_STORM_EVERY
+seconds. Scheduled storms start at multiples of that interval on the wall
+clock, so all slaves with synchronized clocks storm together.
+
+For every dropped stream, the time from the drop until the stream is open
+again is reported as storm:reconnect, and until its first put as storm:init,
+both named after the stream. Reconnects made by a new SSE client of the same
+owner (a stream processor or raw stream locust) still count. When every
+dropped stream has a put again, the time since the storm started is
+reported as storm:reconverge. If some haven't after LOCUST_STORM_TIMEOUT
+seconds (default 300), storm:reconverge fails instead. Streams that are
+closed on purpose in the meantime are left out.
+"""
+import logging
+import os
+import random
+import signal
+import time
+import weakref
+
+import gevent
+from gevent.event import Event
+
+from locust.events import request_failure
+
+from stats_aggregator import report_success
+from latency import clock
+from util import clean_name
+
+log = logging.getLogger(__name__)
+
+enabled = os.environ.get('LOCUST_STORM') == '1'
+
+
+class StormTimeout(Exception):
+    pass
+
+
+class Storm(object):
+    def __init__(self, percent=100, waves=1, wave_interval=5, every=None, timeout=300):
+        self.percent = percent
+        self.waves = waves
+        self.wave_interval = wave_interval
+        self.every = every
+        self.timeout = timeout
+        # owner -> its current stream
+        self._streams = weakref.WeakKeyDictionary()
+        # owner -> [dropped at, reconnected]
+        self._pending = weakref.WeakKeyDictionary()
+        self._running = None
+        self._scheduler = None
+        self._reconverged = Event()
+        self._last_init = None
+
+    @classmethod
+    def from_env(cls):
+        every = os.environ.get('LOCUST_STORM_EVERY')
+        return cls(percent=float(os.environ.get('LOCUST_STORM_PERCENT', 100)),
+                   waves=int(os.environ.get('LOCUST_STORM_WAVES', 1)),
+                   wave_interval=float(os.environ.get('LOCUST_STORM_WAVE_INTERVAL', 5)),
+                   every=float(every) if every else None,
+                   timeout=float(os.environ.get('LOCUST_STORM_TIMEOUT', 300)))
+
+    @staticmethod
+    def _owner(stream):
+        return stream.owner if stream.owner is not None else stream
+
+    def on_connected(self, stream):
+        self._streams[self._owner(stream)] = stream
+        if self._scheduler is None and self.every:
+            self._scheduler = gevent.spawn(self._schedule)
+        entry = self._pending.get(self._owner(stream))
+        if entry is not None and not entry[1]:
+            entry[1] = True
+            elapsed = clock() - entry[0]
+            report_success(request_type='storm:reconnect', name=clean_name('GET', stream.url), response_time=int(elapsed * 1000),
+                           response_length=0, response_time_us=elapsed * 1000000)
+
+    def on_put(self, stream):
+        entry = self._pending.pop(self._owner(stream), None)
+        if entry is not None:
+            elapsed = clock() - entry[0]
+            report_success(request_type='storm:init', name=clean_name('GET', stream.url), response_time=int(elapsed * 1000),
+                           response_length=0, response_time_us=elapsed * 1000000)
+            self._last_init = clock()
+            self._check_reconverged()
+
+    def on_closed(self, stream):
+        owner = self._owner(stream)
+        if self._streams.get(owner) is stream:
+            del self._streams[owner]
+            if self._pending.pop(owner, None) is not None:
+                self._check_reconverged()
+
+    def _check_reconverged(self):
+        if not self._pending:
+            self._reconverged.set()
+
+    def trigger(self):
+        """Starts a storm, unless one is still running."""
+        if self._running is not None:
+            log.warning('a storm is still running, ignoring the trigger')
+            return
+        self._running = gevent.spawn(self._run)
+
+    def _drop_wave(self, count):
+        owners = [owner for owner in self._streams.keys() if owner not in self._pending]
+        dropped = random.sample(owners, min(count, len(owners)))
+        now = clock()
+        for owner in dropped:
+            self._pending[owner] = [now, False]
+            self._streams[owner].drop()
+        return len(dropped)
+
+    def _run(self):
+        try:
+            start_time = self._last_init = clock()
+            self._reconverged.clear()
+            total = int(len(self._streams) * self.percent / 100.0)
+            per_wave = -(-total // max(self.waves, 1))
+            dropped = 0
+            log.info('storm: dropping %d streams in %d waves', total, self.waves)
+            for wave in range(self.waves):
+                if wave:
+                    gevent.sleep(self.wave_interval)
+                dropped += self._drop_wave(min(per_wave, total - dropped))
+            self._check_reconverged()
+            if not self._reconverged.wait(max(self.timeout - (clock() - start_time), 0)):
+                elapsed = clock() - start_time
+                e = StormTimeout('%d of %d streams did not reinitialize' % (len(self._pending), dropped))
+                request_failure.fire(request_type='storm:reconverge', name='storm', response_time=int(elapsed * 1000),
+                                     response_length=dropped, exception=e)
+                log.warning('storm: %s after %.3fs', e, elapsed)
+                self._pending.clear()
+                return
+            elapsed = self._last_init - start_time
+            report_success(request_type='storm:reconverge', name='storm', response_time=int(elapsed * 1000),
+                           response_length=dropped, response_time_us=elapsed * 1000000)
+            log.info('storm: %d streams reconverged after %.3fs', dropped, elapsed)
+        finally:
+            self._running = None
+
+    def _schedule(self):
+        while True:
+            gevent.sleep(self.every - time.time() % self.every)
+            self.trigger()
+
+
+storm = Storm.from_env()
+
+
+if enabled:
+    gevent.signal_handler(signal.SIGUSR2, storm.trigger)
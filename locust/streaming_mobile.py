@@ -5,7 +5,6 @@ Default implementation of the streaming component.
 
 from collections import namedtuple
 
-import json
 from threading import Thread
 
 import backoff
@@ -14,9 +13,16 @@ import time
 
 from ldclient.interfaces import UpdateProcessor
 from sse_client import SSEClient
+from pool_registry import get_pool_manager
+from flag_index import FlagKeyIndex
+from payload_cache import decode
+from client_evaluate import precompute
+from propagation import record_propagation
 from ldclient.util import _stream_headers, log, UnsuccessfulResponseException, http_error_message, is_http_error_recoverable
 from ldclient.versioned_data_kind import FEATURES, SEGMENTS
-from locust.events import request_success, request_failure
+from locust.events import request_failure
+from stats_aggregator import report_success
+from latency import clock
 
 # allows for up to 5 minutes to elapse without any data sent across the stream. The heartbeats sent as comments on the
 # stream will keep this from triggering
@@ -27,8 +33,17 @@ STREAM_PATH= '/meval'
 ParsedPath = namedtuple('ParsedPath', ['kind', 'key'])
 
 
+# decoded puts are shared between clients, so the keys are filled in once here
+def _prepare_flags(all_data):
+    for k,v in all_data.items():
+        v['key'] = k
+        precompute(v)
+    return all_data
+
+
 class MobileStreamingUpdateProcessor(Thread, UpdateProcessor):
-    def __init__(self, config, requester, store, ready):
+    def __init__(self, config, requester, store, ready, http=None, init_request_type='ld:init', init_start=None,
+                 flag_keys=None):
         Thread.__init__(self)
         self.daemon = True
         self._uri = config.stream_base_uri + STREAM_PATH + '/' + config.user_b64
@@ -37,6 +52,14 @@ class MobileStreamingUpdateProcessor(Thread, UpdateProcessor):
         self._store = store
         self._running = False
         self._ready = ready
+        self._sse = None
+        # identify() reuses the stream pool of the processor it replaces and
+        # reports the time from the identify call to the new user's flags
+        self.http = http or get_pool_manager(config.stream_base_uri, verify_ssl=config.verify_ssl,
+            force_proxy=config.http_proxy)
+        self._init_request_type = init_request_type
+        self._init_start = init_start
+        self.flag_keys = flag_keys if flag_keys is not None else FlagKeyIndex()
 
         # We need to suppress the default logging behavior of the backoff package, because
         # it logs messages at ERROR level with variable content (the delay time) which will
@@ -53,28 +76,32 @@ class MobileStreamingUpdateProcessor(Thread, UpdateProcessor):
         self._running = True
         while self._running:
             try:
-                init_start = time.time()
+                init_start = self._init_start or clock()
+                self._init_start = None
                 messages = self._connect()
                 for msg in messages:
                     if not self._running:
                         break
-                    message_ok = self.process_message(self._store, self._requester, msg)
+                    message_ok = self.process_message(self._store, self._requester, msg, self.flag_keys)
                     if message_ok is True and self._ready.is_set() is False:
                         log.info("MobileStreamingUpdateProcessor initialized ok.")
-                        init_duration = int((time.time() - init_start) * 1000)
-                        request_success.fire(request_type="ld:init", name="mobile", response_time=init_duration, response_length=0)
+                        init_duration = clock() - init_start
+                        report_success(request_type=self._init_request_type, name="mobile", response_time=int(init_duration * 1000), response_length=0,
+                                       response_time_us=init_duration * 1000000)
                         self._ready.set()
             except UnsuccessfulResponseException as e:
                 log.error(http_error_message(e.status, "stream connection"))
-                init_duration = int((time.time() - init_start) * 1000)
-                request_failure.fire(request_type="ld:init", name="mobile", response_time=init_duration, response_length=0, exception=e)
+                init_duration = int((clock() - init_start) * 1000)
+                request_failure.fire(request_type=self._init_request_type, name="mobile", response_time=init_duration, response_length=0, exception=e)
                 if not is_http_error_recoverable(e.status):
                     self._ready.set()  # if client is initializing, make it stop waiting; has no effect if already inited
                     self.stop()
                     break
             except Exception as e:
-                init_duration = int((time.time() - init_start) * 1000)
-                request_failure.fire(request_type="ld:init", name="mobile", response_time=init_duration, response_length=0, exception=e)
+                if not self._running:
+                    break
+                init_duration = int((clock() - init_start) * 1000)
+                request_failure.fire(request_type=self._init_request_type, name="mobile", response_time=init_duration, response_length=0, exception=e)
                 log.warning("Caught exception. Restarting stream connection after one second. %s" % e)
                 # no stacktrace here because, for a typical connection error, it'll just be a lengthy tour of urllib3 internals
             time.sleep(1)
@@ -92,29 +119,33 @@ class MobileStreamingUpdateProcessor(Thread, UpdateProcessor):
     @backoff.on_exception(_backoff_expo, BaseException, max_tries=None, jitter=backoff.full_jitter,
                           on_backoff=log_backoff_message, giveup=should_not_retry)
     def _connect(self):
-        return SSEClient(
+        self._sse = SSEClient(
             self._uri,
             headers=_stream_headers(self._config.sdk_key),
             connect_timeout=self._config.connect_timeout,
             read_timeout=stream_read_timeout,
             verify_ssl=self._config.verify_ssl,
-            http_proxy=self._config.http_proxy)
+            http=self.http,
+            http_proxy=self._config.http_proxy,
+            owner=self)
+        return self._sse
 
     def stop(self):
         log.info("Stopping MobileStreamingUpdateProcessor")
         self._running = False
+        if self._sse is not None:
+            self._sse.close()
 
     def initialized(self):
         return self._running and self._ready.is_set() is True and self._store.initialized is True
 
     # Returns True if we initialized the feature store
     @staticmethod
-    def process_message(store, requester, msg):
+    def process_message(store, requester, msg, flag_keys=None):
+        if flag_keys is None:
+            flag_keys = FlagKeyIndex()
         if msg.event == 'put':
-            all_data = json.loads(msg.data)
-
-            for k,v in all_data.items():
-                v['key'] = k
+            all_data = decode('put', msg.data, _prepare_flags)
 
             init_data = {
                 FEATURES: all_data
@@ -122,32 +153,35 @@ class MobileStreamingUpdateProcessor(Thread, UpdateProcessor):
             log.debug("Received put event with %d flags",
                 len(init_data[FEATURES]))
             store.init(init_data)
+            flag_keys.reset(all_data)
             return True
         elif msg.event == 'patch':
             recv_time = time.time() * 1000
-            payload = json.loads(msg.data)
+            payload = decode('patch', msg.data, precompute)
             if payload.get('key') == 'locust-heartbeat':
                 value = int(payload.get('value') or 0)
-                duration = int((recv_time - value))
-                request_success.fire(request_type='sse:flag-update', name='/meval', response_time=duration, response_length=0)
+                record_propagation('/meval', value, recv_time)
                 
             log.debug("Received patch event for %s, New version: [%d]", payload.get('key'), payload.get("version"))
             store.upsert(FEATURES, payload)
+            flag_keys.add(payload.get('key'))
         elif msg.event == 'ping':
             log.debug('Received ping event')
             all_data = requester.get_all_data()
             store.init(all_data)
+            flag_keys.reset(all_data[FEATURES])
             log.debug("Received flags after ping event with %d flags", len(all_data[FEATURES]))
             return True
             
         elif msg.event == 'delete':
-            payload = json.loads(msg.data)
+            payload = decode('delete', msg.data)
             key = payload.get('key')
             # noinspection PyShadowingNames
             version = payload['version']
             log.debug("Received delete event for %s, New version: [%d]", key, version)
             target = ParsedPath(kind = FEATURES, key = key)
             store.delete(target.kind, target.key, version)
+            flag_keys.remove(key)
         else:
             log.warning('Unhandled event in stream processor: ' + msg.event)
         return False
@@ -1,8 +1,16 @@
 from ldclient.version import VERSION
 from ldclient.util import _get_proxy_url, certifi, throw_if_unsuccessful_response, UnsuccessfulResponseException
-from locust.events import request_success, request_failure
+from locust.events import request_failure
+from stats_aggregator import report_success
+from latency import clock
+import recorder
 import urllib3
+from urllib3.util.connection import allowed_gai_family
+import os
+import random
+import socket
 import time
+from array import array
 try:
   from urlparse import urlparse, urlunparse
 except ImportError:
@@ -25,98 +33,303 @@ def clean_name(method, url):
   
       
   
-class LocustProxyPoolManager(urllib3.ProxyManager):
+class AliasTable(object):
+    """
+    Walker's alias method: O(n) to build, O(1) to draw a weighted random index.
+    """
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError('weights must contain a positive value')
+        self._n = n
+        self._prob = array('d', bytes(array('d').itemsize * n))
+        self._alias = array('l', bytes(array('l').itemsize * n))
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in large + small:
+            self._prob[i] = 1.0
+
+    @classmethod
+    def from_arrays(cls, prob, alias):
+        """A table over arrays from arrays(), for example mapped from a file."""
+        table = cls.__new__(cls)
+        table._n = len(prob)
+        table._prob = prob
+        table._alias = alias
+        return table
+
+    def arrays(self):
+        return self._prob, self._alias
+
+    def __len__(self):
+        return self._n
+
+    def sample(self, rng=random):
+        i = int(rng.random() * self._n)
+        return i if rng.random() < self._prob[i] else self._alias[i]
+
+
+# report phase:ttfb and phase:body for every request, see urlopen
+phase_stats = os.environ.get('LOCUST_PHASE_STATS', '1') != '0'
+
+
+def _report_phase(phase, name, duration):
+    report_success(request_type='phase:' + phase, name=name, response_time=int(duration * 1000), response_length=0,
+                   response_time_us=duration * 1000000)
+
+
+class PoolStats(object):
+    """
+    Socket counters for every pool that shares a registry key. Each change is
+    also reported to locust as a pool:* request named after the key, and
+    every new socket's DNS lookup, TCP connect and TLS handshake as
+    phase:dns, phase:connect and phase:tls.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.opened = 0
+        self.reused = 0
+        self.dropped = 0
+
+    def on_opened(self, connect_time, dns_time=None, tcp_time=None, tls_time=None):
+        self.opened += 1
+        report_success(request_type='pool:opened', name=self.name, response_time=int(connect_time * 1000), response_length=0,
+                       response_time_us=connect_time * 1000000)
+        for phase, duration in (('dns', dns_time), ('connect', tcp_time), ('tls', tls_time)):
+            if duration is not None:
+                _report_phase(phase, self.name, duration)
+
+    def on_reused(self):
+        self.reused += 1
+        report_success(request_type='pool:reused', name=self.name, response_time=0, response_length=0)
+
+    def on_dropped(self, lifetime):
+        self.dropped += 1
+        report_success(request_type='pool:dropped', name=self.name, response_time=int(lifetime * 1000), response_length=0)
+
+
+class _InstrumentedConnectionMixin(object):
+    """
+    Times the phases of opening a socket. The host is resolved here so that
+    the lookup can be timed apart from the TCP connect, and urllib3 then
+    connects to each address in turn until one answers, as it would have
+    done itself. Whatever connect() spends after that is the TLS handshake
+    (and the CONNECT to a proxy, if there is one).
+    """
+    pool_stats = None
+    _opened_at = None
+    _dns_time = None
+    _tcp_time = None
+
+    def _new_conn(self):
+        start_time = clock()
+        host = self._dns_host
+        try:
+            addresses = socket.getaddrinfo(host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror:
+            addresses = None
+        if not addresses:
+            # let urllib3 fail the usual way
+            return super(_InstrumentedConnectionMixin, self)._new_conn()
+        self._dns_time = clock() - start_time
+        error = None
+        try:
+            for address in addresses:
+                # host is derived from _dns_host, so it has to be put back before TLS uses it for SNI
+                self._dns_host = address[4][0]
+                attempt_at = clock()
+                try:
+                    conn = super(_InstrumentedConnectionMixin, self)._new_conn()
+                except (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError) as e:
+                    error = e
+                    continue
+                self._tcp_time = clock() - attempt_at
+                return conn
+        finally:
+            self._dns_host = host
+        raise error
+
+    def connect(self):
+        self._dns_time = self._tcp_time = None
+        start_time = clock()
+        super(_InstrumentedConnectionMixin, self).connect()
+        self._opened_at = clock()
+        if self.pool_stats is not None:
+            connect_time = self._opened_at - start_time
+            tls_time = None
+            if isinstance(self, urllib3.connection.HTTPSConnection) and self._tcp_time is not None:
+                tls_time = max(connect_time - self._dns_time - self._tcp_time, 0.0)
+            self.pool_stats.on_opened(connect_time, self._dns_time, self._tcp_time, tls_time)
+
+    def getresponse(self, *args, **kwargs):
+        # the request has been sent, so this waits for the status line and headers
+        sent_at = clock()
+        response = super(_InstrumentedConnectionMixin, self).getresponse(*args, **kwargs)
+        response.locust_headers_at = clock()
+        response.locust_ttfb = response.locust_headers_at - sent_at
+        return response
+
+    def close(self):
+        if self.sock is not None and self.pool_stats is not None:
+            self.pool_stats.on_dropped(clock() - (self._opened_at or clock()))
+        super(_InstrumentedConnectionMixin, self).close()
+
+
+class LocustHTTPConnection(_InstrumentedConnectionMixin, urllib3.connection.HTTPConnection):
+    pass
+
+
+class LocustHTTPSConnection(_InstrumentedConnectionMixin, urllib3.connection.HTTPSConnection):
+    pass
+
+
+class _InstrumentedPoolMixin(object):
+    pool_stats = None
+    keep_alive = True
+
+    def _new_conn(self):
+        conn = super(_InstrumentedPoolMixin, self)._new_conn()
+        conn.pool_stats = self.pool_stats
+        return conn
+
+    def _get_conn(self, timeout=None):
+        conn = super(_InstrumentedPoolMixin, self)._get_conn(timeout)
+        if conn.sock is not None and self.pool_stats is not None:
+            self.pool_stats.on_reused()
+        return conn
+
+    def _put_conn(self, conn):
+        if not self.keep_alive and conn:
+            conn.close()
+        super(_InstrumentedPoolMixin, self)._put_conn(conn)
+
+
+class LocustHTTPConnectionPool(_InstrumentedPoolMixin, urllib3.HTTPConnectionPool):
+    ConnectionCls = LocustHTTPConnection
+
+
+class LocustHTTPSConnectionPool(_InstrumentedPoolMixin, urllib3.HTTPSConnectionPool):
+    ConnectionCls = LocustHTTPSConnection
+
+
+def _record_request(req_type, method, url, kw, resp, content_len, elapsed, error=None):
+    fields = dict(t=time.time() - elapsed, type=req_type, method=method, url=url, status=getattr(resp, 'status', None),
+                  sent=len(kw.get('body') or b''), bytes=content_len, us=int(elapsed * 1000000))
+    if error is not None:
+        fields['error'] = repr(error)
+    recorder.record('http', **fields)
+
+
+class _LocustPoolManagerMixin(object):
+    """
+    Reports every request made through the pool manager to locust, and hands
+    out connection pools that count opened, reused and dropped sockets.
+    urlopen takes two extra keyword arguments: request_type overrides the
+    reported request type, and report_body_size reports the size of the
+    request body instead of the response.
+
+    The time until the response headers arrived is also reported as
+    phase:ttfb and, unless the body is streamed, the time it took to read the
+    body as phase:body. LOCUST_PHASE_STATS=0 turns these two off.
+    """
     def __init__(self, *args, **kwargs):
-      super(LocustProxyPoolManager, self).__init__(*args, **kwargs)
+        self.pool_stats = kwargs.pop('pool_stats', None)
+        self.keep_alive = kwargs.pop('keep_alive', True)
+        super(_LocustPoolManagerMixin, self).__init__(*args, **kwargs)
+        self.pool_classes_by_scheme = {
+            'http': LocustHTTPConnectionPool,
+            'https': LocustHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super(_LocustPoolManagerMixin, self)._new_pool(scheme, host, port, request_context=request_context)
+        pool.pool_stats = self.pool_stats
+        pool.keep_alive = self.keep_alive
+        return pool
 
     def urlopen(self, method, url, redirect=True, **kw):
         is_stream = not kw.get('preload_content', True)
-        start_time = time.time()
+        start_time = clock()
         name = clean_name(method, url)
-        req_type = method
-        
+        req_type = kw.pop('request_type', None) or method
+        report_body_size = kw.pop('report_body_size', False)
+
         if is_stream and kw.get('headers', {}).get('Accept', 'lol') == 'text/event-stream':
           req_type = 'sse:connect'
-        
+
         resp = None
         content_len = 0
-        
-        try:  
-          resp = super(LocustProxyPoolManager, self).urlopen(method, url, redirect, **kw)
-          if is_stream:
+
+        try:
+          resp = super(_LocustPoolManagerMixin, self).urlopen(method, url, redirect, **kw)
+          if report_body_size:
+            content_len = len(kw.get('body') or b"")
+          elif is_stream:
             content_len = int(resp.headers.get("content-length") or 0)
           else:
             content_len = len(resp.data or b"")
           throw_if_unsuccessful_response(resp)
         except UnsuccessfulResponseException as e:
-          request_failure.fire(request_type=req_type, name=name, exception=e, response_length=content_len, response_time=int( (time.time() - start_time) * 1000 ))
+          request_failure.fire(request_type=req_type, name=name, exception=e, response_length=content_len, response_time=int( (clock() - start_time) * 1000 ))
+          if recorder.enabled:
+            _record_request(req_type, method, url, kw, resp, content_len, clock() - start_time, e)
           return resp
         except Exception as e:
-          request_failure.fire(request_type=req_type, name=name, exception=e, response_length=content_len, response_time=int( (time.time() - start_time) * 1000 ))
+          request_failure.fire(request_type=req_type, name=name, exception=e, response_length=content_len, response_time=int( (clock() - start_time) * 1000 ))
+          if recorder.enabled:
+            _record_request(req_type, method, url, kw, resp, content_len, clock() - start_time, e)
           raise e
-        request_success.fire(request_type=req_type, name=name, response_length=content_len, response_time=int( (time.time() - start_time) * 1000 ))
+        end_time = clock()
+        elapsed = end_time - start_time
+        report_success(request_type=req_type, name=name, response_length=content_len, response_time=int(elapsed * 1000), response_time_us=elapsed * 1000000)
+        if recorder.enabled:
+          _record_request(req_type, method, url, kw, resp, content_len, elapsed)
+        original = getattr(resp, '_original_response', None)
+        if phase_stats and getattr(original, 'locust_headers_at', None) is not None:
+          _report_phase('ttfb', name, original.locust_ttfb)
+          if not is_stream:
+            _report_phase('body', name, end_time - original.locust_headers_at)
         return resp
 
-class LocustPoolManager(urllib3.PoolManager):
-    def __init__(self, *args, **kwargs):
-      super(LocustPoolManager, self).__init__(*args, **kwargs)
 
-    def urlopen(self, method, url, redirect=True, **kw):
-        is_stream = not kw.get('preload_content', True)
-        start_time = time.time()
-        x = urlparse(url)
-        name = url
-        req_type = method
-        if method == 'GET' and (x.path.find('/meval/') == 0  or x.path.find('/users/') > -1 or x.path.find('/eval/') == 0):
-          parts = x.path.split('/')
-          parts.pop()
-          parts.append('[user]')
-          newpath = '/'.join(parts)
-          x = x._replace(path=newpath)
-          name = urlunparse(x)
-        
+class LocustProxyPoolManager(_LocustPoolManagerMixin, urllib3.ProxyManager):
+    pass
 
-        if is_stream and kw.get('headers', {}).get('Accept', 'lol') == 'text/event-stream':
-          req_type = 'sse:connect'
-        
-        resp = None
-        content_len = 0
-        
-        try:  
-          resp = super(LocustPoolManager, self).urlopen(method, url, redirect, **kw)
-          if is_stream:
-            content_len = int(resp.headers.get("content-length") or 0)
-          else:
-            content_len = len(resp.data or b"")
-          throw_if_unsuccessful_response(resp)
-        except UnsuccessfulResponseException as e:
-          request_failure.fire(request_type=req_type, name=name, exception=e, response_length=content_len, response_time=int( (time.time() - start_time) * 1000 ))
-          return resp
-        except Exception as e:
-          request_failure.fire(request_type=req_type, name=name, exception=e, response_length=content_len, response_time=int( (time.time() - start_time) * 1000 ))
-          raise e
-        request_success.fire(request_type=req_type, name=name, response_length=content_len, response_time=int( (time.time() - start_time) * 1000 ))
-        return resp
 
-def create_http_pool_manager(num_pools=1, verify_ssl=False, target_base_uri=None, force_proxy=None):
+class LocustPoolManager(_LocustPoolManagerMixin, urllib3.PoolManager):
+    pass
+
+
+def create_http_pool_manager(num_pools=1, verify_ssl=False, target_base_uri=None, force_proxy=None,
+                             maxsize=1, keep_alive=True, pool_stats=None):
     proxy_url = force_proxy or _get_proxy_url(target_base_uri)
+    pool_kw = dict(num_pools=num_pools, maxsize=maxsize, keep_alive=keep_alive, pool_stats=pool_stats)
 
     if not verify_ssl:
         if proxy_url is None:
-            return LocustPoolManager(num_pools=num_pools)
+            return LocustPoolManager(**pool_kw)
         else:
-            return LocustProxyPoolManager(proxy_url, num_pools=num_pools)
-    
+            return LocustProxyPoolManager(proxy_url, **pool_kw)
+
     if proxy_url is None:
         return LocustPoolManager(
-            num_pools=num_pools,
             cert_reqs='CERT_REQUIRED',
-            ca_certs=certifi.where()
+            ca_certs=certifi.where(),
+            **pool_kw
             )
     else:
         return LocustProxyPoolManager(
             proxy_url,
-            num_pools=num_pools,
             cert_reqs='CERT_REQUIRED',
-            ca_certs=certifi.where()
+            ca_certs=certifi.where(),
+            **pool_kw
         )
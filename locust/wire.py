@@ -0,0 +1,120 @@
+"""
+Bytes received by SSE streams.
+
+urlopen can only report the content-length of a stream, which is 0 for SSE,
+so Locust shows no traffic for the connections that carry most of it.
+SSEClient counts what it reads off every stream instead: the body bytes
+(without the chunked encoding's framing), and the size of each event by its
+type (put, patch, delete, ping, comment for heartbeats, and so on).
+
+Every LOCUST_WIRE_INTERVAL seconds (default 1) the counts are reported as
+the wire:bytes request type with the byte count as the response length:
+named all for body bytes, and after the event type for event bytes. The
+total content length of each in Locust's stats is what the worker received.
+When a stream ends, wire:stream reports its bytes and how long it was open.
+
+With LOCUST_WIRE_SERIES set to a CSV path, the master (or the local runner)
+also appends a row per worker, name and interval with the bytes and bytes
+per second, which gives the throughput over time for sizing relay NICs.
+"""
+import csv
+import logging
+import os
+import time
+
+import gevent
+from locust import events
+import locust.runners as runners
+
+from stats_aggregator import report_success
+
+log = logging.getLogger(__name__)
+
+interval = float(os.environ.get('LOCUST_WIRE_INTERVAL', 1))
+series_path = os.environ.get('LOCUST_WIRE_SERIES')
+
+ALL = 'all'
+
+_window = {}
+_totals = {}
+_samples = []
+_greenlet = None
+
+
+def _is_slave():
+    return isinstance(runners.locust_runner, runners.SlaveLocustRunner)
+
+
+def count(name, nbytes):
+    _window[name] = _window.get(name, 0) + nbytes
+
+
+def totals():
+    """Bytes received by this process since it started, by name."""
+    return dict(_totals)
+
+
+def start():
+    global _greenlet
+    if _greenlet is None and interval > 0:
+        _greenlet = gevent.spawn(_flush_forever)
+
+
+def flush():
+    global _window
+    window, _window = _window, {}
+    now = time.time()
+    samples = []
+    for name, nbytes in window.items():
+        if not isinstance(name, str):
+            name = name.decode('utf-8', 'replace')
+        _totals[name] = _totals.get(name, 0) + nbytes
+        report_success(request_type='wire:bytes', name=name, response_time=0, response_length=nbytes)
+        samples.append([now, name, nbytes])
+    if series_path and samples:
+        if _is_slave():
+            _samples.extend(samples)
+        else:
+            _write_series('local', samples)
+
+
+def _flush_forever():
+    while True:
+        gevent.sleep(interval)
+        flush()
+
+
+def _write_series(worker, samples):
+    new_file = not os.path.exists(series_path)
+    with open(series_path, 'a') as series_file:
+        writer = csv.writer(series_file)
+        if new_file:
+            writer.writerow(['Timestamp', 'Worker', 'Name', 'Bytes', 'Bytes/s'])
+        for timestamp, name, nbytes in samples:
+            writer.writerow([int(timestamp), worker, name, nbytes, round(nbytes / interval, 1)])
+
+
+def _on_report_to_master(client_id, data):
+    global _samples
+    data['wire'] = _samples
+    _samples = []
+
+
+def _on_slave_report(client_id, data):
+    try:
+        if data.get('wire'):
+            _write_series(client_id, data['wire'])
+    except Exception as e:
+        log.error('failed to write the throughput series: %s', e)
+
+
+def _on_quitting():
+    flush()
+    if _totals:
+        log.info('bytes received by streams: %s', ', '.join('%s %d' % item for item in sorted(_totals.items())))
+
+
+if series_path:
+    events.report_to_master += _on_report_to_master
+    events.slave_report += _on_slave_report
+events.quitting += _on_quitting